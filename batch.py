@@ -0,0 +1,177 @@
+"""
+Batch evaluation of many expressions against one rule set.
+
+The rules are parsed and compiled once. With workers > 1 the compiled RuleSet is sent
+to each worker process once, when the process starts, and expressions are sent in chunks.
+Results come back in input order.
+
+normalize_parallel() instead splits one very large term into independent subterms and
+normalizes those in worker processes, shipping them in the termcodec binary format.
+"""
+import itertools
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from main import Term, Function, NormalFormCache, compile_rules, evaluate, normalize
+from termcodec import dumps_many, loads_many
+
+# The rule set and options of a worker process, set once by _init_worker.
+_worker_rules = None
+_worker_options = None
+
+def _init_worker(rules, options: dict) -> None:
+    global _worker_rules, _worker_options
+    _worker_rules = rules
+    _worker_options = options
+
+def _trace_level(trace) -> str:
+    """The evaluate() trace level for iter_evaluate's trace: a level name, or a bool for 'full' or 'off'."""
+    if trace is True:
+        return 'full'
+    if trace is False or trace is None:
+        return 'off'
+    return trace
+
+def _evaluate_one(expression, rules, trace_level: str, return_exceptions: bool, options: dict):
+    if isinstance(expression, Exception):
+        if not return_exceptions:
+            raise expression
+        return expression
+    try:
+        result, trace = evaluate(expression, rules, trace=trace_level, **options)
+    except Exception as error:
+        if not return_exceptions:
+            raise
+        return error
+    return result if trace_level == 'off' else (result, trace)
+
+def _evaluate_chunk(expressions: list, trace_level: str, return_exceptions: bool) -> list:
+    return [_evaluate_one(expression, _worker_rules, trace_level, return_exceptions, _worker_options)
+            for expression in expressions]
+
+def _chunks(iterable, size: int):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def iter_evaluate(expressions, rules, workers: int = None, chunksize: int = 256,
+                  trace=False, max_pending: int = None, return_exceptions: bool = False,
+                  **options):
+    """
+    Evaluates expressions (any iterable of expression strings) against rules and yields
+    the normal forms in input order, or (normal form, trace) pairs if trace is True or a
+    trace level other than 'off' ('full', 'compact' or 'counts', see evaluate). Without
+    a trace, none is recorded.
+    Extra keyword arguments (strategy, backend, ...) are passed to evaluate().
+    With return_exceptions, an expression that fails yields its exception instead of
+    stopping the whole batch. An exception given in place of an expression (such as an
+    input record that could not be read) is not evaluated but treated as its failure,
+    so it keeps its place in the output.
+
+    workers is the number of worker processes (default: the CPU count); with 1 or fewer,
+    everything runs in this process. At most max_pending chunks (default: twice the
+    worker count) are in flight, so the input is consumed lazily and memory stays bounded.
+    """
+    rules = compile_rules(rules)
+    trace = _trace_level(trace)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        for expression in expressions:
+            yield _evaluate_one(expression, rules, trace, return_exceptions, options)
+        return
+
+    max_pending = max_pending or 2 * workers
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(rules, options)) as executor:
+        pending = deque()
+        for chunk in _chunks(expressions, chunksize):
+            pending.append(executor.submit(_evaluate_chunk, chunk, trace, return_exceptions))
+            if len(pending) >= max_pending:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+def evaluate_many(expressions, rules, workers: int = None, chunksize: int = 256,
+                  trace=False, **options) -> list:
+    """
+    Evaluates every expression against rules and returns the results in input order.
+    See iter_evaluate for the arguments.
+    """
+    return list(iter_evaluate(expressions, rules, workers, chunksize, trace, **options))
+
+_CHUNK = '(chunk)' # Not a name the parser can produce, so no rule or builtin has it
+
+def _normalize_chunk(data: bytes) -> bytes:
+    backend = _worker_options.get('backend', 'interpreted')
+    terms = loads_many(data)
+    # Normalized as the arguments of one node that no rule can match, so subterms shared
+    # between the terms are normalized once.
+    normal_forms = normalize(Function(_CHUNK, terms), _worker_rules, None, 'innermost', backend=backend).args
+    return dumps_many(list(normal_forms))
+
+def _partition(term: Term, task_size: int, min_task_size: int) -> list:
+    """
+    Returns the distinct subterms of at most task_size nodes (and at least min_task_size)
+    that lie directly below the nodes larger than task_size, largest first. Under
+    innermost rewriting each of them is normalized independently of the rest of the term.
+    """
+    tasks = []
+    seen = set()
+    pending = [term]
+    while pending:
+        node = pending.pop()
+        if node in seen or node.size < min_task_size:
+            continue
+        seen.add(node)
+        if node.size <= task_size or not isinstance(node, Function):
+            tasks.append(node)
+        else:
+            pending.extend(node.args)
+    tasks.sort(key=lambda task: task.size, reverse=True)
+    return tasks
+
+def normalize_parallel(term: Term, rules, workers: int = None, threshold: int = 100_000,
+                       tasks_per_worker: int = 4, backend: str = 'interpreted') -> Term:
+    """
+    Normalizes term with the innermost strategy like normalize(), using worker processes
+    for large terms. A term of threshold nodes or more is split into independent
+    subterms of about term.size / (workers * tasks_per_worker) nodes, which are
+    normalized concurrently; their normal forms are then stitched back in while the
+    rest of the term is normalized here. The result is the same normal form normalize()
+    gives. No trace is kept. Rule sets with strat annotations are normalized here, since
+    their lazy arguments must not be evaluated ahead of time.
+    """
+    rules = compile_rules(rules)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or term.size < threshold or rules.strategies:
+        return normalize(term, rules, None, 'innermost', backend=backend)
+
+    task_size = max(1, term.size // (workers * tasks_per_worker))
+    tasks = _partition(term, task_size, min_task_size=max(1, task_size // 16))
+
+    # Deal the tasks out largest first, each to the chunk with the fewest nodes so far.
+    chunk_count = min(len(tasks), workers * tasks_per_worker)
+    chunks = [[] for _ in range(chunk_count)]
+    loads = [0] * chunk_count
+    for task in tasks:
+        lightest = loads.index(min(loads))
+        chunks[lightest].append(task)
+        loads[lightest] += task.size
+
+    # Large enough that no task's entry is evicted before the walk below reaches it.
+    cache = NormalFormCache(maxsize=term.size + 2 * len(tasks))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(rules, {'backend': backend})) as executor:
+        futures = [(chunk, executor.submit(_normalize_chunk, dumps_many(chunk))) for chunk in chunks]
+        for chunk, future in futures:
+            for task, normal_form in zip(chunk, loads_many(future.result())):
+                cache.put(rules, 'innermost', task, normal_form)
+                cache.put(rules, 'innermost', normal_form, normal_form)
+    # The cache answers for every task, so only the nodes above them are normalized here.
+    return normalize(term, rules, None, 'innermost', cache, backend)
@@ -0,0 +1,246 @@
+"""
+Benchmarks for the rewriting engine.
+
+    python bench.py run [--quick] [--output results.json]
+    python bench.py compare baseline.json results.json [--threshold 0.10]
+    python bench.py scaling --count 20000 --workers 1 2 4 8
+
+'run' times generated workloads (deep Not chains, wide And/Or/Xor trees over the sample
+rules, Peano arithmetic, large infix expressions, and And/Or trees under short-circuiting
+rules with and without strat annotations), recording parse time, rewrite
+steps per second, peak memory and pass count for each, and writes them as JSON.
+'compare' reports the change in each timing between two such files and exits with
+status 1 if any got slower by more than the threshold.
+'scaling' measures evaluate_many throughput for each worker count.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from main import RuleSet, TraceRecorder, sample_rules, parse_expression, parse_infix_expression, \
+    substitute_variables, normalize, apply_single_rule_pass
+from batch import evaluate_many
+
+peano_rules = """
+Add: 2
+Add(Z(), y) -> y
+Add(S(x), y) -> S(Add(x, y))
+
+Mul: 2
+Mul(Z(), y) -> Z()
+Mul(S(x), y) -> Add(y, Mul(x, y))
+"""
+
+# Short-circuiting And/Or: with the strat annotations the second argument is only
+# evaluated when the first does not decide the result.
+short_circuit_rules = """
+And: 2 strat(1 0 2 0)
+And(false, x) -> false
+And(true, x) -> x
+
+Or: 2 strat(1 0 2 0)
+Or(true, x) -> true
+Or(false, x) -> x
+
+Not: 1
+Not(true) -> false
+Not(false) -> true
+"""
+eager_short_circuit_rules = short_circuit_rules.replace(" strat(1 0 2 0)", "")
+
+def random_boolean_expression(rng: random.Random, depth: int, leaves=('true', 'false'),
+                              ops=('And', 'Or', 'Xor', 'Not')) -> str:
+    """Returns a random expression of the given depth over ops (And/Or/Xor/Not by default)."""
+    if depth == 0:
+        return rng.choice(leaves)
+    op = rng.choice(ops)
+    if op == 'Not':
+        return f"Not({random_boolean_expression(rng, depth - 1, leaves, ops)})"
+    left = random_boolean_expression(rng, depth - 1, leaves, ops)
+    right = random_boolean_expression(rng, depth - 1, leaves, ops)
+    return f"{op}({left}, {right})"
+
+def balanced_boolean_expression(rng: random.Random, depth: int) -> str:
+    """Returns a complete binary And/Or/Xor tree with 2**depth true/false leaves."""
+    level = [rng.choice(['true', 'false']) for _ in range(2 ** depth)]
+    while len(level) > 1:
+        level = [f"{rng.choice(['And', 'Or', 'Xor'])}({level[i]}, {level[i + 1]})"
+                 for i in range(0, len(level), 2)]
+    return level[0]
+
+def peano(n: int) -> str:
+    return "S(" * n + "Z()" + ")" * n
+
+def infix_expression(rng: random.Random, operands: int) -> str:
+    parts = [str(rng.randint(1, 9))]
+    for _ in range(operands - 1):
+        parts.append(rng.choice('+-*'))
+        parts.append(str(rng.randint(1, 9)))
+    return " ".join(parts)
+
+def workloads(quick: bool = False) -> list:
+    """Returns (name, rules text, expression text, parser) for each generated workload."""
+    rng = random.Random(0)
+    scale = 0.1 if quick else 1
+    deep = int(100_000 * scale)
+    wide = 10 if quick else 14
+    short_circuit = random_boolean_expression(rng, 12 if quick else 18, ops=('And', 'Or', 'Not'))
+    return [
+        (f"not_chain_{deep}", sample_rules, "Not(" * deep + "true" + ")" * deep, parse_expression),
+        (f"balanced_bool_2^{wide}", sample_rules, balanced_boolean_expression(rng, wide), parse_expression),
+        ("random_bool_depth_12", sample_rules, random_boolean_expression(rng, 12), parse_expression),
+        (f"peano_mul_{int(60 * scale) + 5}", peano_rules,
+         f"Mul({peano(int(60 * scale) + 5)}, {peano(int(60 * scale) + 5)})", parse_expression),
+        (f"infix_{int(50_000 * scale)}", "", infix_expression(rng, int(50_000 * scale)), parse_infix_expression),
+        ("short_circuit_eager", eager_short_circuit_rules, short_circuit, parse_expression),
+        ("short_circuit_lazy", short_circuit_rules, short_circuit, parse_expression),
+    ]
+
+def _rewrite(term, rules, strategy: str, recorder: TraceRecorder) -> int:
+    """Normalizes term and returns the number of passes it took."""
+    if strategy != 'passes':
+        normalize(term, rules, recorder, strategy)
+        return 1
+    passes, changed = 0, True
+    while changed:
+        term, changed = apply_single_rule_pass(term, rules, recorder)
+        passes += 1
+    return passes
+
+def run_workload(name: str, rules_text: str, expression: str, parser, strategy: str, repeat: int) -> dict:
+    rules = RuleSet.from_string(rules_text)
+    parse_seconds, rewrite_seconds = float('inf'), float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        term = substitute_variables(parser(expression), rules.assignments)
+        parse_seconds = min(parse_seconds, time.perf_counter() - start)
+        recorder = TraceRecorder('counts')
+        start = time.perf_counter()
+        passes = _rewrite(term, rules, strategy, recorder)
+        rewrite_seconds = min(rewrite_seconds, time.perf_counter() - start)
+    steps = sum(recorder.counts.values())
+
+    # Memory is measured in a separate run, since tracing allocations slows everything down.
+    tracemalloc.start()
+    _rewrite(term, rules, strategy, TraceRecorder('counts'))
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {'name': name, 'strategy': strategy, 'nodes': term.size,
+            'parse_seconds': parse_seconds, 'rewrite_seconds': rewrite_seconds,
+            'steps': steps, 'steps_per_second': steps / rewrite_seconds if rewrite_seconds else 0.0,
+            'peak_memory_bytes': peak_memory, 'passes': passes}
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_suite(strategies: list, repeat: int = 3, quick: bool = False, only: list = None) -> dict:
+    results = []
+    for name, rules_text, expression, parser in workloads(quick):
+        if only and not any(pattern in name for pattern in only):
+            continue
+        for strategy in strategies:
+            if strategy == 'passes' and name.startswith('not_chain'):
+                continue # One pass per two levels; quadratic by design
+            results.append(run_workload(name, rules_text, expression, parser, strategy, repeat))
+    return {'commit': _git_commit(), 'python': platform.python_version(),
+            'platform': platform.platform(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'results': results}
+
+def compare(baseline: dict, current: dict, threshold: float) -> list:
+    """Returns (name, strategy, metric, old, new, ratio, regressed) for each timing in both files."""
+    old = {(row['name'], row['strategy']): row for row in baseline['results']}
+    rows = []
+    for row in current['results']:
+        before = old.get((row['name'], row['strategy']))
+        if before is None:
+            continue
+        for metric in ('parse_seconds', 'rewrite_seconds', 'peak_memory_bytes'):
+            if not before[metric]:
+                continue
+            ratio = row[metric] / before[metric]
+            rows.append((row['name'], row['strategy'], metric, before[metric], row[metric],
+                         ratio, ratio > 1 + threshold))
+    return rows
+
+def bench_scaling(count: int, depth: int, worker_counts: list, chunksize: int, seed: int = 0) -> list:
+    """Times evaluate_many over the same expressions for each worker count."""
+    rng = random.Random(seed)
+    expressions = [random_boolean_expression(rng, depth) for _ in range(count)]
+    rules = RuleSet.from_string(sample_rules)
+    rows = []
+    baseline = None
+    for workers in worker_counts:
+        start = time.perf_counter()
+        evaluate_many(expressions, rules, workers=workers, chunksize=chunksize)
+        seconds = time.perf_counter() - start
+        baseline = baseline or seconds
+        rows.append({'workers': workers, 'seconds': seconds,
+                     'expressions_per_second': count / seconds, 'speedup': baseline / seconds})
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='run the workload suite')
+    run.add_argument('--strategies', nargs='+', default=['innermost'],
+                     choices=['innermost', 'outermost', 'passes'])
+    run.add_argument('--repeat', type=int, default=3)
+    run.add_argument('--quick', action='store_true', help='smaller workloads')
+    run.add_argument('--only', nargs='+', help='run workloads whose name contains any of these')
+    run.add_argument('--output', help='write results as JSON to this file')
+
+    comparison = commands.add_parser('compare', help='compare two result files')
+    comparison.add_argument('baseline')
+    comparison.add_argument('current')
+    comparison.add_argument('--threshold', type=float, default=0.10, help='allowed slowdown (default 0.10)')
+
+    scaling = commands.add_parser('scaling', help='evaluate_many throughput per worker count')
+    scaling.add_argument('--count', type=int, default=20000)
+    scaling.add_argument('--depth', type=int, default=6)
+    scaling.add_argument('--chunksize', type=int, default=256)
+    scaling.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, os.cpu_count() or 1])
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        suite = run_suite(args.strategies, args.repeat, args.quick, args.only)
+        print(f"{'workload':<24} {'strategy':<10} {'nodes':>8} {'parse s':>9} {'rewrite s':>10} "
+              f"{'steps':>8} {'steps/s':>10} {'peak MB':>8} {'passes':>6}")
+        for row in suite['results']:
+            print(f"{row['name']:<24} {row['strategy']:<10} {row['nodes']:>8} {row['parse_seconds']:>9.4f} "
+                  f"{row['rewrite_seconds']:>10.4f} {row['steps']:>8} {row['steps_per_second']:>10.0f} "
+                  f"{row['peak_memory_bytes'] / 1e6:>8.2f} {row['passes']:>6}")
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as stream:
+                json.dump(suite, stream, indent=2)
+    elif args.command == 'compare':
+        with open(args.baseline, encoding='utf-8') as stream:
+            baseline = json.load(stream)
+        with open(args.current, encoding='utf-8') as stream:
+            current = json.load(stream)
+        regressions = 0
+        for name, strategy, metric, old, new, ratio, regressed in compare(baseline, current, args.threshold):
+            regressions += regressed
+            flag = '  REGRESSION' if regressed else ''
+            print(f"{name:<24} {strategy:<10} {metric:<18} {old:>12.4g} {new:>12.4g} {ratio:>7.2f}x{flag}")
+        return 1 if regressions else 0
+    elif args.command == 'scaling':
+        print(f"{'workers':>8} {'seconds':>10} {'expr/s':>12} {'speedup':>8}")
+        for row in bench_scaling(args.count, args.depth, args.workers, args.chunksize):
+            print(f"{row['workers']:>8} {row['seconds']:>10.3f} "
+                  f"{row['expressions_per_second']:>12.0f} {row['speedup']:>8.2f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
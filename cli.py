@@ -0,0 +1,146 @@
+"""
+Command-line evaluation of expression files.
+
+    python main.py RULES_FILE [INPUT ...] [--format lines|jsonl] [--trace] [--workers N]
+                   [--compiled RULES_FILE.rwc]
+
+RULES_FILE holds rules and assignments in the usual format. Expressions are read from
+each INPUT file, or from stdin if none is given (or for '-'), either one per line or as
+JSON lines with an "expression" field (and optionally an "id"). Records are streamed
+through the evaluator and each normal form is written as soon as it is ready, so inputs
+of any size run in bounded memory.
+"""
+import argparse
+import json
+import sys
+from collections import deque
+
+from main import RuleSet, format_term
+from batch import iter_evaluate
+from rulefile import load_rules
+
+class RecordError(ValueError):
+    """An input line that is not a valid record; line holds its text."""
+    def __init__(self, message: str, line: str):
+        super().__init__(message)
+        self.line = line
+
+    def __reduce__(self):
+        return self.__class__, (self.args[0], self.line)
+
+def read_records(stream, input_format: str = 'lines'):
+    """
+    Yields (id, expression) for each non-blank input line; ids default to the line number.
+    A JSON line that cannot be read yields (line number, RecordError) instead.
+    """
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if input_format == 'jsonl':
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict) or not isinstance(record.get('expression'), str):
+                    raise ValueError('expected an object with an "expression" string')
+            except ValueError as error:
+                yield line_number, RecordError(f"Invalid record on line {line_number}: {error}", line)
+                continue
+            yield record.get('id', line_number), record['expression']
+        else:
+            yield line_number, line
+
+def evaluate_records(records, rules, trace: bool = False, **options):
+    """
+    Evaluates (id, expression) records in order and yields (id, expression, outcome),
+    where outcome is the normal form (or (normal form, trace) if trace is True), or the
+    exception raised for that expression. A record whose expression is a RecordError
+    is not evaluated; it yields (id, its line, the error). Options are passed to
+    batch.iter_evaluate.
+    """
+    in_flight = deque()
+
+    def expressions():
+        # A RecordError goes through the pipeline too, so it is written in its place
+        # as soon as the records before it are.
+        for record in records:
+            in_flight.append(record)
+            yield record[1]
+
+    for outcome in iter_evaluate(expressions(), rules, trace=trace, return_exceptions=True, **options):
+        record_id, expression = in_flight.popleft()
+        if isinstance(expression, RecordError):
+            expression = expression.line
+        yield record_id, expression, outcome
+
+def format_output(record_id, expression: str, outcome, output_format: str, trace: bool) -> str:
+    """Formats one evaluated record as a line of text or a JSON line."""
+    if isinstance(outcome, Exception):
+        if output_format == 'jsonl':
+            return json.dumps({'id': record_id, 'expression': expression, 'error': str(outcome)})
+        return f"error: {outcome}"
+
+    result, steps = outcome if trace else (outcome, None)
+    if output_format == 'jsonl':
+        output = {'id': record_id, 'expression': expression, 'result': format_term(result)}
+        if trace:
+            output['trace'] = [{'before': format_term(before), 'rule': f"{lhs} -> {rhs}", 'after': format_term(after)}
+                               for before, lhs, rhs, after in steps]
+        return json.dumps(output)
+
+    lines = [format_term(result)]
+    if trace:
+        for i, (before, lhs, rhs, after) in enumerate(steps):
+            lines.append(f"  Step {i+1}: {format_term(before)} => {format_term(after)} by {lhs} -> {rhs}")
+    return "\n".join(lines)
+
+def _input_lines(paths: list):
+    for path in paths or ['-']:
+        if path == '-':
+            yield from sys.stdin
+        else:
+            with open(path, encoding='utf-8') as stream:
+                yield from stream
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='main.py', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('rules_file', help='file with rules and assignments')
+    parser.add_argument('inputs', nargs='*', help="expression files (default: stdin, also '-')")
+    parser.add_argument('--format', choices=['lines', 'jsonl'], default='lines', help='input format')
+    parser.add_argument('--output', choices=['text', 'jsonl'],
+                        help='output format (default: text for lines input, jsonl for jsonl input)')
+    parser.add_argument('--trace', action='store_true', help='also write the rewrite steps')
+    parser.add_argument('--strategy', choices=['innermost', 'outermost', 'passes'], default='innermost')
+    parser.add_argument('--backend', choices=['interpreted', 'compiled'], default='interpreted')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes (default: 1, in-process)')
+    parser.add_argument('--chunksize', type=int, default=256, help='expressions per worker task')
+    parser.add_argument('--max-steps', type=int, help='fail an expression needing more rewrite steps')
+    parser.add_argument('--timeout', type=float, help='fail an expression taking longer (seconds)')
+    parser.add_argument('--max-size', type=int, help='fail an expression whose term grows larger')
+    parser.add_argument('--detect-cycles', action='store_true', help='fail an expression whose rewriting cycles')
+    parser.add_argument('--compiled', metavar='PATH',
+                        help='load the rules from this compiled rule file, rewriting it if the rules file changed')
+    args = parser.parse_args(argv)
+    output_format = args.output or ('jsonl' if args.format == 'jsonl' else 'text')
+
+    if args.compiled:
+        rules = load_rules(args.rules_file, args.compiled)
+    else:
+        with open(args.rules_file, encoding='utf-8') as stream:
+            rules = RuleSet.from_string(stream.read())
+
+    failures = 0
+    records = read_records(_input_lines(args.inputs), args.format)
+    for record_id, expression, outcome in evaluate_records(
+            records, rules, trace=args.trace, workers=args.workers, chunksize=args.chunksize,
+            strategy=args.strategy, backend=args.backend, max_steps=args.max_steps, timeout=args.timeout,
+            max_size=args.max_size, detect_cycles=args.detect_cycles):
+        try:
+            line = format_output(record_id, expression, outcome, output_format, args.trace)
+        except Exception as error: # E.g. an integer too long to write out; reported like a failed evaluation
+            outcome = error
+            line = format_output(record_id, expression, error, output_format, args.trace)
+        failures += isinstance(outcome, Exception)
+        sys.stdout.write(line + "\n")
+    sys.stdout.flush()
+    return 1 if failures else 0
@@ -0,0 +1,331 @@
+"""
+Flat, array-backed term encoding.
+
+A FlatTerm stores a term as a preorder array of (symbol id, arity) pairs in an
+array('i'), with function names, constants and variables interned to integer ids in a
+SymbolTable. This takes a few bytes per node instead of one Python object per node, and
+is traversed without touching any Term objects. FlatRuleSet matches and rewrites
+directly on this form. encode_dag / decode_dag instead store each distinct node once,
+for shipping terms with much sharing.
+"""
+from array import array
+
+from main import Term, Function, Constant, Variable, compile_rules
+
+# Symbol kinds
+FUNCTION = 0
+CONSTANT = 1
+VARIABLE = 2
+
+class SymbolTable:
+    """Interns function names, constant values and variable names to integer ids."""
+    def __init__(self):
+        self.kinds = []
+        self.payloads = []
+        self._ids = {}
+
+    def intern(self, kind: int, payload) -> int:
+        # The payload type is part of the key so that 1 and True get distinct ids.
+        key = (kind, type(payload), payload)
+        symbol_id = self._ids.get(key)
+        if symbol_id is None:
+            symbol_id = len(self.kinds)
+            self._ids[key] = symbol_id
+            self.kinds.append(kind)
+            self.payloads.append(payload)
+        return symbol_id
+
+    def symbol_for(self, term: Term) -> int:
+        if isinstance(term, Function):
+            return self.intern(FUNCTION, term.name)
+        if isinstance(term, Constant):
+            return self.intern(CONSTANT, term.value)
+        if isinstance(term, Variable):
+            return self.intern(VARIABLE, term.name)
+        raise ValueError(f"Unknown term type during encoding: {type(term)}")
+
+    def __len__(self):
+        return len(self.kinds)
+
+class FlatTerm:
+    """
+    A term stored as a preorder array of (symbol id, arity) pairs.
+    Node i occupies data[2 * i] (symbol id) and data[2 * i + 1] (arity).
+    """
+    __slots__ = ('symbols', 'data')
+
+    def __init__(self, symbols: SymbolTable, data: array):
+        self.symbols = symbols
+        self.data = data
+
+    @classmethod
+    def from_term(cls, term: Term, symbols: SymbolTable = None) -> "FlatTerm":
+        """Encodes term; shared subterms are written out once per occurrence."""
+        symbols = symbols if symbols is not None else SymbolTable()
+        data = array('i')
+        pending = [term]
+        while pending:
+            term = pending.pop()
+            data.append(symbols.symbol_for(term))
+            if isinstance(term, Function):
+                data.append(len(term.args))
+                pending.extend(reversed(term.args))
+            else:
+                data.append(0)
+        return cls(symbols, data)
+
+    def to_term(self) -> Term:
+        """Decodes back into (interned) Term objects."""
+        return _decode(self.symbols, self.data, len(self.data) // 2 - 1, -1)
+
+    def subterm_end(self, position: int) -> int:
+        """Returns the node index just past the subterm starting at position."""
+        return _subterm_end(self.data, position, 1)
+
+    def subterm(self, position: int) -> "FlatTerm":
+        end = self.subterm_end(position)
+        return FlatTerm(self.symbols, self.data[2 * position:2 * end])
+
+    def to_numpy(self):
+        """Returns the encoding as an (n, 2) NumPy int32 array sharing this term's buffer."""
+        try:
+            import numpy
+        except ImportError as error:
+            raise ImportError("FlatTerm.to_numpy() requires NumPy") from error
+        return numpy.frombuffer(self.data, dtype=numpy.intc).reshape(-1, 2)
+
+    def __len__(self):
+        return len(self.data) // 2
+
+    def __eq__(self, other):
+        if not isinstance(other, FlatTerm):
+            return NotImplemented
+        if self.symbols is other.symbols:
+            return self.data == other.data
+        return self.to_term() is other.to_term()
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"FlatTerm({len(self)} nodes)"
+
+def encode_dag(terms: list):
+    """
+    Encodes terms as a SymbolTable, one table of their distinct nodes in postorder, each
+    (symbol id, argument node ids), and the node id of each term. Unlike FlatTerm, a
+    subterm shared within or between the terms is stored, and later rebuilt, once. The
+    tables are made of lists, tuples, ints and strings, so they pickle and marshal.
+    """
+    symbols = SymbolTable()
+    nodes = []
+    ids = {}
+    function_symbols = {} # Function name -> symbol id, to skip SymbolTable.intern per node
+    for term in terms:
+        stack = [term]
+        while stack:
+            node = stack[-1]
+            if node in ids:
+                stack.pop()
+                continue
+            if node.__class__ is Function:
+                args = node.args
+                waiting = False
+                for arg in args:
+                    if arg not in ids:
+                        stack.append(arg)
+                        waiting = True
+                if waiting:
+                    continue
+                symbol_id = function_symbols.get(node.name)
+                if symbol_id is None:
+                    symbol_id = function_symbols[node.name] = symbols.intern(FUNCTION, node.name)
+                ids[node] = len(nodes)
+                nodes.append((symbol_id, tuple([ids[arg] for arg in args])))
+            else:
+                ids[node] = len(nodes)
+                nodes.append((symbols.symbol_for(node), ()))
+            stack.pop()
+    return symbols, nodes, [ids[term] for term in terms]
+
+def decode_dag(kinds: list, payloads: list, nodes: list) -> list:
+    """Rebuilds the (interned) term for every node of an encode_dag node table."""
+    terms = []
+    for symbol_id, args in nodes:
+        kind = kinds[symbol_id]
+        if kind == FUNCTION:
+            terms.append(Function(payloads[symbol_id], [terms[arg] for arg in args]))
+        elif kind == CONSTANT:
+            terms.append(Constant(payloads[symbol_id]))
+        else:
+            terms.append(Variable(payloads[symbol_id]))
+    return terms
+
+def _subterm_end(data: array, position: int, step: int) -> int:
+    """Walks one whole subterm from position in direction step (1 for preorder order,
+    -1 for reversed order) and returns the node index just past it."""
+    need = 1
+    while need:
+        need += data[2 * position + 1] - 1
+        position += step
+    return position
+
+def _decode(symbols: SymbolTable, data: array, first: int, last: int) -> Term:
+    """Decodes the nodes from first down to (not including) last, in reversed preorder,
+    so each node's arguments are already built when it is reached."""
+    kinds, payloads = symbols.kinds, symbols.payloads
+    stack = []
+    for position in range(first, last, -1):
+        symbol_id = data[2 * position]
+        arity = data[2 * position + 1]
+        kind = kinds[symbol_id]
+        if kind == FUNCTION:
+            args = stack[len(stack) - arity:]
+            del stack[len(stack) - arity:]
+            args.reverse()
+            stack.append(Function(payloads[symbol_id], args))
+        elif kind == CONSTANT:
+            stack.append(Constant(payloads[symbol_id]))
+        else:
+            stack.append(Variable(payloads[symbol_id]))
+    return stack[0]
+
+def _match(pattern: array, kinds: list, data: array, root: int, step: int):
+    """
+    Matches a flat pattern against the subterm of data rooted at node root. Nodes are
+    read in direction step, so the same code matches preorder data (step 1) and the
+    reversed buffer of FlatRuleSet.normalize (step -1). Returns a dict from variable
+    symbol id to the (start, end) node range it is bound to, or None.
+    """
+    bindings = {}
+    position = root
+    for p in range(0, len(pattern), 2):
+        symbol_id = pattern[p]
+        if kinds[symbol_id] == VARIABLE:
+            end = _subterm_end(data, position, step)
+            span = (position, end) if step > 0 else (end + 1, position + 1)
+            bound = bindings.get(symbol_id)
+            if bound is None:
+                bindings[symbol_id] = span
+            elif data[2 * bound[0]:2 * bound[1]] != data[2 * span[0]:2 * span[1]]:
+                return None
+            position = end
+        else:
+            if data[2 * position] != symbol_id or data[2 * position + 1] != pattern[p + 1]:
+                return None
+            position += step
+    return bindings
+
+def match_flat(pattern: FlatTerm, target: FlatTerm, position: int = 0):
+    """
+    Matches pattern against the subterm of target starting at node position. Both must
+    use the same SymbolTable. Returns a dict from variable name to the bound FlatTerm,
+    or None if the pattern does not match.
+    """
+    if pattern.symbols is not target.symbols:
+        raise ValueError("Pattern and target must share a SymbolTable")
+    bindings = _match(pattern.data, pattern.symbols.kinds, target.data, position, 1)
+    if bindings is None:
+        return None
+    payloads = pattern.symbols.payloads
+    return {payloads[symbol_id]: FlatTerm(target.symbols, target.data[2 * start:2 * end])
+            for symbol_id, (start, end) in bindings.items()}
+
+class FlatRuleSet:
+    """
+    A RuleSet with its patterns encoded against a SymbolTable, for rewriting FlatTerms
+    without building Term objects. Only the rules are applied, not the rule set's builtins,
+    and strat annotations are ignored.
+    """
+    def __init__(self, rules, symbols: SymbolTable = None):
+        self.rules = compile_rules(rules)
+        self.symbols = symbols if symbols is not None else SymbolTable()
+        # Function name -> [(rule, flat lhs, flat rhs)] in file order. Like the compiled
+        # backend, rules whose left side can never match a node of that name are dropped.
+        self._by_name = {}
+        for name, rule_list in self.rules.rules.items():
+            entries = []
+            for rule in rule_list:
+                if (isinstance(rule.lhs, Function) and rule.lhs.name != name) or isinstance(rule.lhs, Constant):
+                    continue
+                entries.append((rule, FlatTerm.from_term(rule.lhs, self.symbols).data,
+                                FlatTerm.from_term(rule.rhs, self.symbols).data))
+            self._by_name[name] = entries
+        self._by_symbol = {}
+
+    def encode(self, term: Term) -> FlatTerm:
+        return FlatTerm.from_term(term, self.symbols)
+
+    def _rules_for(self, symbol_id: int) -> list:
+        entries = self._by_symbol.get(symbol_id)
+        if entries is None:
+            entries = []
+            if self.symbols.kinds[symbol_id] == FUNCTION:
+                entries = self._by_name.get(self.symbols.payloads[symbol_id], [])
+            self._by_symbol[symbol_id] = entries
+        return entries
+
+    def normalize(self, term: FlatTerm, trace: list = None) -> FlatTerm:
+        """
+        Rewrites term to normal form innermost-first, working on the flat encoding only.
+        The ids of the applied rules are appended to trace if a list is given.
+
+        Nodes are read from the end of the input (reversed preorder, so every node comes
+        after its arguments) and their normal forms are appended to a buffer in the same
+        reversed order. A node's arguments therefore sit just below it in the buffer, and
+        when a rule applies the node's span is cut off and the instantiated right side is
+        fed back in; bound subterms are copied in as already-normal spans.
+        """
+        if isinstance(term, Term):
+            term = self.encode(term)
+        elif term.symbols is not self.symbols:
+            term = self.encode(term.to_term())
+        kinds = self.symbols.kinds
+        source = term.data
+        next_node = len(source) // 2 - 1
+        pending = [] # Rewritten input, consumed before the rest of source
+        buffer = array('i')
+        starts = [] # Buffer node index where each finished subterm starts
+
+        while pending or next_node >= 0:
+            if pending:
+                item = pending.pop()
+                if isinstance(item, array):
+                    starts.append(len(buffer) // 2)
+                    buffer.extend(item) # Already in normal form
+                    continue
+                symbol_id, arity = item
+            else:
+                symbol_id = source[2 * next_node]
+                arity = source[2 * next_node + 1]
+                next_node -= 1
+
+            start = starts[len(starts) - arity] if arity else len(buffer) // 2
+            del starts[len(starts) - arity:]
+            root = len(buffer) // 2
+            buffer.append(symbol_id)
+            buffer.append(arity)
+
+            for rule, lhs, rhs in self._rules_for(symbol_id):
+                bindings = _match(lhs, kinds, buffer, root, -1)
+                if bindings is None:
+                    continue
+                if trace is not None:
+                    trace.append(rule.rule_id)
+                replacement = []
+                for p in range(0, len(rhs), 2):
+                    bound = bindings.get(rhs[p]) if kinds[rhs[p]] == VARIABLE else None
+                    if bound is None:
+                        replacement.append((rhs[p], rhs[p + 1]))
+                    else:
+                        replacement.append(buffer[2 * bound[0]:2 * bound[1]])
+                del buffer[2 * start:]
+                pending.extend(replacement)
+                break
+            else:
+                starts.append(start)
+
+        # The buffer holds the result in reversed preorder; reversing it flips each
+        # (symbol id, arity) pair as well, so swap them back.
+        buffer.reverse()
+        buffer[0::2], buffer[1::2] = buffer[1::2], buffer[0::2]
+        return FlatTerm(self.symbols, buffer)
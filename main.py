@@ -1,3 +1,15 @@
+import functools
+import heapq
+import itertools
+import json
+import operator
+import re
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+
 sample_rules = """
 And: 2
 And(true, true) -> true
@@ -24,37 +36,240 @@ Not(Not(x)) -> x
 """
 
 # --- AST Node Classes ---
+# Terms are hash-consed: building a term that already exists returns the existing object,
+# so structurally equal terms are the same object and equality is a pointer comparison.
+# Terms keep object's identity hash, which agrees with identity equality. The intern tables
+# map each key to a weak reference, so a term is freed once nothing else uses it and its
+# entry is then removed. A lookup that finds a live term needs no lock; a miss looks again
+# and inserts under _intern_lock, and entries are removed under it too, so threads building
+# the same term always get one object. The lock is reentrant because a term freed while it
+# is held removes its entry in the same thread.
+_functions = {}
+_constants = {}
+_variables = {}
+_intern_lock = threading.RLock()
+_set_slot = object.__setattr__
+
+def _remover(table: dict):
+    def remove(ref):
+        with _intern_lock:
+            # The key may already hold a newer term
+            if table.get(ref.key) is ref:
+                del table[ref.key]
+    return remove
+
+_remove_function = _remover(_functions)
+_remove_constant = _remover(_constants)
+_remove_variable = _remover(_variables)
+
+# Functions up to this size pickle as nested (name, args) tuples, larger ones through termcodec.
+_PICKLE_INLINE_SIZE = 64
+
 class Term:
-    pass
+    __slots__ = ('size', '__weakref__')
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} terms are immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} terms are immutable")
 
 class Function(Term):
-    def __init__(self, name: str, args: list):
-        self.name = name
-        self.args = args
+    __slots__ = ('name', 'args')
+
+    def __new__(cls, name: str, args=()):
+        args = tuple(args)
+        key = (name, args)
+        ref = _functions.get(key)
+        node = None if ref is None else ref()
+        if node is None:
+            with _intern_lock:
+                ref = _functions.get(key)
+                node = None if ref is None else ref()
+                if node is None:
+                    node = object.__new__(cls)
+                    _set_slot(node, 'name', name)
+                    _set_slot(node, 'args', args)
+                    size = 1
+                    for arg in args:
+                        size += arg.size
+                    _set_slot(node, 'size', size)
+                    _functions[key] = weakref.KeyedRef(node, _remove_function, key)
+        return node
+
+    def __reduce__(self):
+        if self.size <= _PICKLE_INLINE_SIZE:
+            return (Function, (self.name, self.args))
+        # Pickling nested Functions recurses once per level and loses sharing between
+        # subterms, so a large term is pickled as one termcodec blob instead, or, if it
+        # holds a constant termcodec cannot encode, as its list of distinct nodes.
+        import termcodec
+        try:
+            return (termcodec.loads, (termcodec.dumps(self),))
+        except TypeError:
+            return (_from_dag_entries, (_dag_entries(self),))
 
     def __repr__(self):
-        return f"Function({self.name}, {self.args})"
+        return f"Function({self.name}, {list(self.args)})"
 
 class Constant(Term):
-    def __init__(self, value):
-        self.value = value
+    __slots__ = ('value',)
+
+    def __new__(cls, value):
+        # Keyed on the type as well, so Constant(1) and Constant(True) stay distinct.
+        key = (type(value), value)
+        ref = _constants.get(key)
+        node = None if ref is None else ref()
+        if node is None:
+            with _intern_lock:
+                ref = _constants.get(key)
+                node = None if ref is None else ref()
+                if node is None:
+                    node = object.__new__(cls)
+                    _set_slot(node, 'value', value)
+                    _set_slot(node, 'size', 1)
+                    _constants[key] = weakref.KeyedRef(node, _remove_constant, key)
+        return node
+
+    def __reduce__(self):
+        return (Constant, (self.value,))
 
     def __repr__(self):
         return f"Constant({self.value})"
 
-    def __eq__(self, other):
-        # Constant(False) == Constant(False)
-        if isinstance(other, Constant):
-            return self.value == other.value
-        return False
-
 class Variable(Term):
-    def __init__(self, name: str):
-        self.name = name
+    __slots__ = ('name',)
+
+    def __new__(cls, name: str):
+        ref = _variables.get(name)
+        node = None if ref is None else ref()
+        if node is None:
+            with _intern_lock:
+                ref = _variables.get(name)
+                node = None if ref is None else ref()
+                if node is None:
+                    node = object.__new__(cls)
+                    _set_slot(node, 'name', name)
+                    _set_slot(node, 'size', 1)
+                    _variables[name] = weakref.KeyedRef(node, _remove_variable, name)
+        return node
+
+    def __reduce__(self):
+        return (Variable, (self.name,))
 
     def __repr__(self):
         return f"Variable({self.name})"
 
+def is_ground(term: Term) -> bool:
+    """Returns True if term contains no variables."""
+    pending = [term]
+    seen = set()
+    while pending:
+        term = pending.pop()
+        if isinstance(term, Variable):
+            return False
+        if isinstance(term, Function) and term not in seen:
+            seen.add(term) # Shared subterms are checked once
+            pending.extend(term.args)
+    return True
+
+# Terms are hash-consed, so a term is really a DAG: equal subterms are one shared node, and
+# term.size (the size of the written-out tree) can be exponential in the number of distinct
+# nodes. Everything that walks terms visits each distinct node once; format_term and
+# FlatTerm.from_term write the tree out in full.
+def dag_nodes(term: Term) -> list:
+    """Returns the distinct nodes of term in postorder (arguments before their parents)."""
+    nodes = []
+    seen = set()
+    stack = [term]
+    while stack:
+        node = stack[-1]
+        if node in seen:
+            stack.pop()
+            continue
+        if isinstance(node, Function):
+            pending = [arg for arg in node.args if arg not in seen]
+            if pending:
+                stack.extend(reversed(pending))
+                continue
+        seen.add(node)
+        nodes.append(node)
+        stack.pop()
+    return nodes
+
+def _dag_entries(term: Term) -> list:
+    # The distinct nodes of term in postorder, each function as (name, indices of its arguments).
+    nodes = dag_nodes(term)
+    index = {node: i for i, node in enumerate(nodes)}
+    return [(node.name, tuple(index[arg] for arg in node.args)) if isinstance(node, Function) else node
+            for node in nodes]
+
+def _from_dag_entries(entries: list) -> Term:
+    built = []
+    for entry in entries:
+        if isinstance(entry, Term):
+            built.append(entry)
+        else:
+            built.append(Function(entry[0], [built[i] for i in entry[1]]))
+    return built[-1]
+
+def dag_size(term: Term) -> int:
+    """Returns the number of distinct nodes in term (term.size counts every occurrence)."""
+    return len(dag_nodes(term))
+
+def format_term(term: Term, limit: int = None) -> str:
+    """
+    Formats a term in the prefix syntax read by parse_expression, e.g. 'And(x, true)'.
+    The text grows with term.size, which for a term with shared subterms can be exponential
+    in its distinct nodes; with limit, at most limit nodes are written and each remaining
+    subterm is written as '...'.
+    """
+    parts = []
+    stack = [term]
+    written = 0
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            parts.append(item)
+            continue
+        if limit is not None:
+            if written >= limit:
+                parts.append('...')
+                continue
+            written += 1
+        if isinstance(item, Function):
+            parts.append(item.name + '(')
+            stack.append(')')
+            for i in range(len(item.args) - 1, -1, -1):
+                stack.append(item.args[i])
+                if i:
+                    stack.append(', ')
+        elif isinstance(item, Constant):
+            if item.value is True or item.value is False:
+                parts.append('true' if item.value else 'false')
+            else:
+                parts.append(str(item.value))
+        else:
+            parts.append(item.name)
+    return ''.join(parts)
+
+_STRAT = re.compile(r'strat\(([^)]*)\)')
+
+def parse_arity_declaration(text: str) -> tuple:
+    """
+    Parses the part of an arity line after the colon, e.g. '2' or '2 strat(1 0 2 0)'.
+    Returns (arity, strategy), where strategy is the tuple of strat positions or None.
+    """
+    strategy = None
+    match = _STRAT.search(text)
+    if match is not None:
+        try:
+            strategy = tuple(int(position) for position in match.group(1).split())
+        except ValueError:
+            raise ValueError(f"Invalid strategy annotation: {match.group(0)}") from None
+        text = text[:match.start()] + text[match.end():]
+    return int(text.strip()), strategy
+
 def parse_rules(rules: str):
     # Parse the rules from the given string and return a dictionary of rules and their arities.
     rule_dict = {}
@@ -66,7 +281,7 @@ def parse_rules(rules: str):
         if ':' in line:
             parts = line.split(':')
             current_rule = parts[0].strip()
-            arity_dict[current_rule] = int(parts[1].strip())
+            arity_dict[current_rule] = parse_arity_declaration(parts[1])[0]
             rule_dict[current_rule] = []
         elif '->' in line and current_rule is not None:
             # if a line has an expression -> expression, it is a rule
@@ -78,85 +293,134 @@ def parse_rules(rules: str):
     return rule_dict, arity_dict
 
 # --- Parser ---
-def parse_term_recursive(tokens: list, index: list) -> Term:
-    """Recursively parses tokens to build a Term (Constant, Variable, or Function).
+def parse_term(tokens: list, index: list) -> Term:
+    """Parses tokens to build a Term (Constant, Variable, or Function).
     index is a list to allow modification by reference for the current token position.
+    Uses an explicit stack of open functions, so nesting depth is not bounded by the
+    interpreter's recursion limit.
     """
-    if index[0] >= len(tokens):
-        raise ValueError("Unexpected end of expression")
-
-    token = tokens[index[0]]
-    index[0] += 1 # Consume the token
-
-    # Check for constants
-    if token == 'true':
-        return Constant(True)
-    elif token == 'false':
-        return Constant(False)
-    # Check for variables (convention: lower case names)
-    elif token[0].islower():
-        return Variable(token)
-    # Assume any other token followed by '(' is a function
-    elif index[0] < len(tokens) and tokens[index[0]] == '(':
-        func_name = token
-        index[0] += 1 # Consume '('
-
-        args = []
-        # Parse arguments until ')' is encountered
-        while index[0] < len(tokens) and tokens[index[0]] != ')':
-            # Parse argument
-            args.append(parse_term_recursive(tokens, index))
-            # Check for comma separator, but don't require it after the last argument
-            if index[0] < len(tokens) and tokens[index[0]] == ',':
-                index[0] += 1 # Consume ','
-            elif index[0] < len(tokens) and tokens[index[0]] != ')':
-                 raise ValueError(f"Expected ',' or ')' after argument for '{func_name}'")
+    stack = [] # (function name, arguments parsed so far) for each unclosed function
+    i = index[0]
+    n = len(tokens)
+    while True:
+        if i >= n:
+            index[0] = i
+            raise ValueError("Unexpected end of expression")
 
-        if index[0] >= len(tokens) or tokens[index[0]] != ')':
-            raise ValueError(f"Expected ')' after arguments for '{func_name}'")
-        index[0] += 1 # Consume ')'
+        token = tokens[i]
+        i += 1 # Consume the token
 
-        return Function(func_name, args)
-    else:
-        # If it's not a known constant, function, or variable, it's an error
-        raise ValueError(f"Unknown term: '{token}'")
+        # Check for constants
+        if token == 'true':
+            term = Constant(True)
+        elif token == 'false':
+            term = Constant(False)
+        # Integer constants, as built by parse_infix_expression and printed by format_term
+        elif token.isdecimal() or (token[0] == '-' and token[1:].isdecimal()):
+            term = Constant(int(token))
+        # Check for variables (convention: lower case names)
+        elif token[0].islower():
+            term = Variable(token)
+        # Assume any other token followed by '(' is a function
+        elif i < n and tokens[i] == '(':
+            i += 1 # Consume '('
+            if i < n and tokens[i] != ')':
+                stack.append((token, []))
+                continue # Parse the first argument
+            if i >= n:
+                raise ValueError(f"Expected ')' after arguments for '{token}'")
+            i += 1 # Consume ')'
+            term = Function(token, ())
+        else:
+            # If it's not a known constant, function, or variable, it's an error
+            raise ValueError(f"Unknown term: '{token}'")
+
+        # Hand the finished term to its parent, closing every function it completes
+        while stack:
+            func_name, args = stack[-1]
+            args.append(term)
+            # Check for comma separator, but don't require it after the last argument
+            if i < n and tokens[i] == ',':
+                i += 1 # Consume ','
+            elif i < n and tokens[i] != ')':
+                raise ValueError(f"Expected ',' or ')' after argument for '{func_name}'")
+            if i < n and tokens[i] != ')':
+                break # Parse the next argument
+            if i >= n:
+                raise ValueError(f"Expected ')' after arguments for '{func_name}'")
+            i += 1 # Consume ')'
+            stack.pop()
+            term = Function(func_name, args)
+        else:
+            index[0] = i
+            return term
 
-def parse_expression(expression: str) -> Term:
-    """Parses a string expression into an AST (Term object)."""
+# Kept for callers of the original recursive parser; parse_term is a drop-in replacement.
+parse_term_recursive = parse_term
+
+def parse_expression(expression: str, cache: 'ParseCache' = None) -> Term:
+    """
+    Parses a string expression into an AST (Term object).
+    With a ParseCache, a string parsed before is not tokenized or parsed again.
+    """
+    if cache is not None:
+        ast = cache.get(expression)
+        if ast is not None:
+            return ast
     tokens = tokenize(expression)
-    # Use a mutable list to pass index by reference for the recursive function
+    # Use a mutable list to pass index by reference
     index = [0]
-    ast = parse_term_recursive(tokens, index)
+    ast = parse_term(tokens, index)
     
     if index[0] != len(tokens):
         raise ValueError(f"Unexpected tokens remaining after parsing: {tokens[index[0]:]}")
+    if cache is not None:
+        cache.put(expression, ast)
     return ast
 
+class ParseCache:
+    """
+    A size-bounded LRU cache from expression strings to their parsed terms, for inputs
+    that repeat. Terms are interned, so a cached term is the same object a fresh parse
+    would return.
+    """
+    def __init__(self, maxsize: int = 10_000):
+        if maxsize <= 0:
+            raise ValueError("maxsize must be positive")
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, expression: str):
+        """Returns the cached term for expression, or None."""
+        ast = self._entries.get(expression)
+        if ast is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(expression)
+        self.hits += 1
+        return ast
+
+    def put(self, expression: str, ast: Term) -> None:
+        self._entries[expression] = ast
+        self._entries.move_to_end(expression)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
 
+    def __len__(self):
+        return len(self._entries)
 
 # --- Tokenizer ---
 def tokenize(expression: str):
     """Tokenizes the expression into a list of tokens."""
-    tokens = []
-    current_token = ''
-    for char in expression:
-        if char in '(),':
-            if current_token:
-                tokens.append(current_token)
-                current_token = ''
-            tokens.append(char) # Always append the delimiter
-        elif char.isspace():
-            if current_token:
-                tokens.append(current_token)
-                current_token = ''
-        else:
-            current_token += char
-    if current_token:
-        tokens.append(current_token)
-    return tokens
+    # Padding the delimiters with spaces lets str.split, which treats whitespace exactly as
+    # str.isspace does, do all the work in C.
+    return expression.replace('(', ' ( ').replace(')', ' ) ').replace(',', ' , ').split()
 
 # --- Evaluate ---
-def parse_rules_and_assignments(rules_and_assignments_string: str):
+def parse_rules_and_assignments(rules_and_assignments_string: str, strategies: dict = None):
+    # With strategies, the strat(...) annotations of arity lines are stored into it by name.
     rule_dict = {}
     arity_dict = {}
     assignment_map = {}
@@ -167,7 +431,9 @@ def parse_rules_and_assignments(rules_and_assignments_string: str):
         if ':' in line and '->' not in line and '=' not in line: # Rule arity declaration
             parts = line.split(':')
             current_rule_name = parts[0].strip()
-            arity_dict[current_rule_name] = int(parts[1].strip())
+            arity_dict[current_rule_name], strategy = parse_arity_declaration(parts[1])
+            if strategy is not None and strategies is not None:
+                strategies[current_rule_name] = strategy
             rule_dict[current_rule_name] = []
         elif '->' in line and current_rule_name is not None: # Rule definition
             expression = line.strip()
@@ -191,102 +457,1572 @@ def parse_rules_and_assignments(rules_and_assignments_string: str):
 
     return rule_dict, arity_dict, assignment_map
 
+# --- Rule Index (Discrimination Tree) ---
+_WILDCARD = object()
+
+def _term_key(term: Term):
+    """Key used by the discrimination tree for the top symbol of a term."""
+    if isinstance(term, Function):
+        return ('f', term.name, len(term.args))
+    return term # Constants and variables are interned, so the term is its own key
+
+class _TreeNode:
+    def __init__(self):
+        self.children = {}
+        self.rules = []
+
+class DiscriminationTree:
+    """
+    Indexes rule patterns by the preorder sequence of their symbols, with pattern
+    variables stored as wildcards. Looking up a term only walks as deep as the stored
+    patterns, and returns just the rules whose shape can match that term.
+    """
+    def __init__(self):
+        self.root = _TreeNode()
+        # Fully ground patterns are also kept in a plain dict; while no pattern has a
+        # variable, a lookup is a single hash probe on the (interned) term.
+        self.ground = {}
+        self.has_variables = False
+
+    def insert(self, pattern: Term, rule) -> None:
+        if is_ground(pattern):
+            self.ground.setdefault(pattern, rule)
+        else:
+            self.has_variables = True
+        node = self.root
+        pending = [pattern]
+        while pending:
+            term = pending.pop()
+            key = _WILDCARD if isinstance(term, Variable) else _term_key(term)
+            node = node.children.setdefault(key, _TreeNode())
+            if isinstance(term, Function):
+                pending.extend(reversed(term.args))
+        node.rules.append(rule)
+
+    def candidates(self, term: Term) -> list:
+        """Returns the rules whose patterns may match term, in priority order."""
+        if not self.has_variables:
+            rule = self.ground.get(term)
+            return [rule] if rule is not None else []
+        found = []
+        # Each entry pairs a tree node with the linked list of subterms still to visit.
+        stack = [(self.root, (term, None))]
+        while stack:
+            node, pending = stack.pop()
+            if pending is None:
+                found.extend(node.rules)
+                continue
+            subterm, rest = pending
+            child = node.children.get(_WILDCARD)
+            if child is not None:
+                stack.append((child, rest))
+            child = node.children.get(_term_key(subterm))
+            if child is not None:
+                if isinstance(subterm, Function):
+                    for arg in reversed(subterm.args):
+                        rest = (arg, rest)
+                stack.append((child, rest))
+        if len(found) > 1:
+            found.sort(key=lambda rule: rule.priority)
+        return found
+
+def patterns_overlap(first: Term, second: Term) -> bool:
+    """
+    Returns True if some term matches both patterns, i.e. they unify once their
+    variables are renamed apart. Rules whose patterns do not overlap can be tried in
+    either order without changing which one fires.
+    """
+    bindings = {} # (side, variable name) -> (side, term)
+
+    def resolve(side, term):
+        while isinstance(term, Variable) and (side, term.name) in bindings:
+            side, term = bindings[(side, term.name)]
+        return side, term
+
+    def occurs(key, side, term):
+        pending = [(side, term)]
+        while pending:
+            side, term = resolve(*pending.pop())
+            if isinstance(term, Variable):
+                if (side, term.name) == key:
+                    return True
+            elif isinstance(term, Function):
+                pending.extend((side, arg) for arg in term.args)
+        return False
+
+    stack = [((0, first), (1, second))]
+    while stack:
+        (side_a, a), (side_b, b) = stack.pop()
+        side_a, a = resolve(side_a, a)
+        side_b, b = resolve(side_b, b)
+        if isinstance(a, Variable) or isinstance(b, Variable):
+            if not isinstance(a, Variable):
+                (side_a, a), (side_b, b) = (side_b, b), (side_a, a)
+            if isinstance(b, Variable) and (side_a, a.name) == (side_b, b.name):
+                continue
+            if occurs((side_a, a.name), side_b, b):
+                return False
+            bindings[(side_a, a.name)] = (side_b, b)
+        elif isinstance(a, Function) and isinstance(b, Function):
+            if a.name != b.name or len(a.args) != len(b.args):
+                return False
+            stack.extend(zip(((side_a, arg) for arg in a.args), ((side_b, arg) for arg in b.args)))
+        elif a is not b:
+            return False
+    return True
+
+# --- Built-in Primitives ---
+def _int_arguments(args: tuple) -> bool:
+    """True if every argument is an integer Constant (not a boolean)."""
+    for arg in args:
+        if arg.__class__ is not Constant or type(arg.value) is not int:
+            return False
+    return True
+
+# Builtins do not produce integers longer than this many bits: a single huge operation
+# cannot be interrupted by an evaluation's timeout, and str() refuses integers of more
+# than 4300 digits, so such results could not be written out either.
+MAX_INT_BITS = 14_000
+
+def _int_power(base: int, exponent: int) -> int:
+    if exponent < 0:
+        raise ArithmeticError("negative exponent") # Would not be an integer
+    # The result has at least exponent * (bits of base - 1) bits; check before computing it.
+    if exponent * (abs(base).bit_length() - 1) > MAX_INT_BITS:
+        raise ArithmeticError("integer result too large")
+    return base ** exponent
+
+class Builtin:
+    """
+    A symbol implemented in Python rather than by rules. name(c1, ..., cn) is rewritten to
+    function(c1.value, ..., cn.value) when the node has arity arguments and accepts(args)
+    holds (by default: all are integer Constants). A result that is not a Term is wrapped
+    in a Constant; if function raises ArithmeticError (e.g. division by zero) or returns
+    an integer of more than MAX_INT_BITS bits, the node is left as it is. Builtins are
+    tried after the rules for the name, and appear in traces like rules, with rule_id
+    'builtin:<name>'.
+    """
+    def __init__(self, name: str, function, arity: int = 2, accepts=None):
+        self.rule_id = f"builtin:{name}"
+        self.name = name
+        self.function = function
+        self.arity = arity
+        self.accepts = accepts if accepts is not None else _int_arguments
+        self.lhs_str = f"{name}({', '.join(f'x{i}' for i in range(arity))})"
+        self.rhs_str = f"<builtin {getattr(function, '__name__', repr(function))}>"
+
+    def apply(self, node: Function):
+        """Returns the rewritten node, or None if the builtin does not apply to node."""
+        args = node.args
+        if len(args) != self.arity or not self.accepts(args):
+            return None
+        try:
+            value = self.function(*[arg.value for arg in args])
+        except ArithmeticError:
+            return None
+        if isinstance(value, Term):
+            return value
+        if type(value) is int and value.bit_length() > MAX_INT_BITS:
+            return None
+        return Constant(value)
+
+    def __repr__(self):
+        return f"Builtin({self.name}/{self.arity})"
+
+# The builtins every new RuleSet starts with: integer arithmetic for the function names
+# parse_infix_expression produces. Div is floor division.
+BUILTINS = {builtin.name: builtin for builtin in [
+    Builtin('Add', operator.add),
+    Builtin('Sub', operator.sub),
+    Builtin('Mul', operator.mul),
+    Builtin('Div', operator.floordiv),
+    Builtin('Pow', _int_power),
+]}
+
+def register_builtin(name: str, function, arity: int = 2, accepts=None) -> Builtin:
+    """Adds a builtin to BUILTINS, for rule sets created from now on."""
+    builtin = BUILTINS[name] = Builtin(name, function, arity, accepts)
+    return builtin
+
+# --- Compiled Rule Sets ---
+_rule_set_ids = itertools.count()
+
+class Rule:
+    """A single rewrite rule with its left and right sides parsed once up front."""
+    def __init__(self, rule_id: int, name: str, lhs_str: str, rhs_str: str,
+                 lhs: Term = None, rhs: Term = None):
+        self.rule_id = rule_id
+        self.name = name
+        self.lhs_str = lhs_str
+        self.rhs_str = rhs_str
+        self.lhs = lhs if lhs is not None else parse_expression(lhs_str)
+        self.rhs = rhs if rhs is not None else parse_expression(rhs_str)
+        self.priority = rule_id # Position among the rules for name; see RuleSet.reorder
+
+    def __repr__(self):
+        return f"Rule({self.rule_id}, {self.lhs_str} -> {self.rhs_str})"
+
+class RuleSet:
+    """
+    A rule set compiled once from the output of parse_rules / parse_rules_and_assignments.
+    Holds the pre-parsed rules grouped by function name, the declared arities and any
+    assignments, so it can be passed to evaluate() any number of times without re-parsing.
+    strategies maps function names to their evaluation strategy (see set_strategy).
+    """
+    def __init__(self, rules: dict, arities: dict = None, assignments: dict = None, strategies: dict = None):
+        self.arities = dict(arities or {})
+        self.assignments = dict(assignments or {})
+        self.strategies = {}
+        self._strategy_arities = {} # name -> the number of arguments its strategy applies to
+        self.rules = {}
+        self.rules_by_id = []
+        self.index = {} # name -> DiscriminationTree, built on the first lookup of name
+        self.builtins = dict(BUILTINS)
+        # uid identifies this rule set and version counts changes to it; together they
+        # key cached normal forms (see NormalFormCache).
+        self.uid = next(_rule_set_ids)
+        self.version = 0
+        self._compiled = None
+        # Rewrites per rule id seen by adaptive evaluation (see reorder).
+        self.hit_counts = {}
+        self.evaluations_since_reorder = 0
+        self._overlaps = {} # name -> {rule_id: ids of earlier rules it overlaps}, built by reorder
+        self._rankings = {} # name -> rule ids by hits when reorder last ran
+        self.reorder_interval = 100
+        for name, rule_list in rules.items():
+            self.rules.setdefault(name, [])
+            for lhs_str, rhs_str in rule_list:
+                self.add_rule(name, lhs_str, rhs_str)
+        for name, strategy in (strategies or {}).items():
+            self.set_strategy(name, strategy)
+        self.version = 0
+
+    @classmethod
+    def from_string(cls, rules_and_assignments_string: str) -> "RuleSet":
+        strategies = {}
+        rules, arities, assignments = parse_rules_and_assignments(rules_and_assignments_string, strategies)
+        return cls(rules, arities, assignments, strategies)
+
+    def add_rule(self, name: str, lhs_str: str, rhs_str: str, lhs: Term = None, rhs: Term = None) -> Rule:
+        """
+        Adds a rule after the existing rules for name. Bumps the rule set version.
+        lhs and rhs may be given pre-parsed; otherwise they are parsed from the strings.
+        """
+        rule = Rule(len(self.rules_by_id), name, lhs_str, rhs_str, lhs, rhs)
+        self.rules_by_id.append(rule)
+        rule_list = self.rules.setdefault(name, [])
+        rule.priority = len(rule_list)
+        rule_list.append(rule)
+        tree = self.index.get(name)
+        if tree is not None:
+            tree.insert(rule.lhs, rule)
+        overlaps = self._overlaps.get(name)
+        if overlaps is not None:
+            overlaps[rule.rule_id] = {earlier.rule_id for earlier in rule_list[:-1]
+                                      if patterns_overlap(earlier.lhs, rule.lhs)}
+        self._rankings.pop(name, None)
+        self.version += 1
+        return rule
+
+    def register_builtin(self, name: str, function, arity: int = 2, accepts=None) -> Builtin:
+        """Adds (or replaces) a builtin for name in this rule set. Bumps the rule set version."""
+        builtin = self.builtins[name] = Builtin(name, function, arity, accepts)
+        self.version += 1
+        return builtin
+
+    def set_strategy(self, name: str, strategy) -> None:
+        """
+        Sets the order in which the innermost strategy evaluates nodes named name, as in a
+        rule file's 'And: 2 strat(1 0 2 0)': each number is an argument position to
+        normalize (1 is the first argument) or 0 to try the rules at the node; arguments
+        that are not listed are never evaluated. The strategy must end with 0. Once a rule
+        applies, the rest of the strategy is skipped, so 'strat(1 0 2 0)' with the rule
+        And(false, x) -> false never evaluates the second argument of And(false, ...).
+        The strategy applies to nodes with the declared arity of name, or, if none is
+        declared, with as many arguments as its highest position; other nodes named name
+        are evaluated with the default strategy. None restores the default, every argument
+        in order and then 0. Bumps the rule set version.
+        """
+        if strategy is None:
+            self.strategies.pop(name, None)
+            self._strategy_arities.pop(name, None)
+        else:
+            strategy = tuple(strategy)
+            arity = self.arities.get(name)
+            if not strategy or strategy[-1] != 0:
+                raise ValueError(f"The strategy of {name} must end with 0")
+            for position in strategy:
+                if position < 0 or (arity is not None and position > arity):
+                    raise ValueError(f"Invalid argument position {position} in the strategy of {name}")
+            self.strategies[name] = strategy
+            self._strategy_arities[name] = max(strategy) if arity is None else arity
+        self.version += 1
+
+    def rules_for(self, name: str) -> list:
+        """Returns the rules declared for the given function name, in the order they are tried."""
+        return self.rules.get(name, ())
+
+    def record_hits(self, counts: dict) -> None:
+        """Adds {rule_id: rewrites} counts (e.g. TraceRecorder.counts) to hit_counts."""
+        for rule_id, count in counts.items():
+            self.hit_counts[rule_id] = self.hit_counts.get(rule_id, 0) + count
+
+    def reorder(self, counts: dict = None) -> bool:
+        """
+        Reorders the rules of each name so the most frequently hit are tried first, using
+        counts ({rule_id: hits}, default hit_counts). A rule only moves ahead of rules
+        whose patterns do not overlap with its own, so the same rule fires for every term
+        as with the file order. Returns True if any order changed (the version is bumped).
+        """
+        counts = self.hit_counts if counts is None else counts
+        changed = False
+        for name, rule_list in self.rules.items():
+            if len(rule_list) < 2:
+                continue
+            # The order only depends on how the rules rank by hits, so skip names whose
+            # ranking has not changed since the last reorder.
+            ranking = tuple(sorted((rule.rule_id for rule in rule_list), key=lambda rule_id: -counts.get(rule_id, 0)))
+            if self._rankings.get(name) == ranking:
+                continue
+            # Overlapping rules keep their file order; everything else may move freely.
+            # Placed greedily, most hits first among the rules whose earlier overlapping
+            # rules are all placed (the earliest in the current order of equals).
+            before = self._overlap_graph(name)
+            waiting = {rule.rule_id: len(before[rule.rule_id]) for rule in rule_list}
+            unblocks = {}
+            for rule_id, earlier_ids in before.items():
+                for earlier in earlier_ids:
+                    unblocks.setdefault(earlier, []).append(rule_id)
+            by_id = {rule.rule_id: (position, rule) for position, rule in enumerate(rule_list)}
+            ready = [(-counts.get(rule.rule_id, 0), position, rule.rule_id)
+                     for position, rule in enumerate(rule_list) if not waiting[rule.rule_id]]
+            heapq.heapify(ready)
+            ordered = []
+            while ready:
+                rule_id = heapq.heappop(ready)[2]
+                ordered.append(by_id[rule_id][1])
+                for later in unblocks.get(rule_id, ()):
+                    waiting[later] -= 1
+                    if not waiting[later]:
+                        heapq.heappush(ready, (-counts.get(later, 0), by_id[later][0], later))
+            if ordered != rule_list:
+                self._set_order(name, ordered)
+                changed = True
+            self._rankings[name] = ranking
+        return changed
+
+    def _overlap_graph(self, name: str) -> dict:
+        """Returns {rule_id: ids of the earlier rules for name whose patterns overlap its own}."""
+        overlaps = self._overlaps.get(name)
+        if overlaps is None:
+            by_file_order = sorted(self.rules[name], key=lambda rule: rule.rule_id)
+            overlaps = self._overlaps[name] = {
+                rule.rule_id: {earlier.rule_id for earlier in by_file_order[:position]
+                               if patterns_overlap(earlier.lhs, rule.lhs)}
+                for position, rule in enumerate(by_file_order)}
+        return overlaps
+
+    def _set_order(self, name: str, ordered: list) -> None:
+        for priority, rule in enumerate(ordered):
+            rule.priority = priority
+        self.rules[name] = ordered
+        self.index.pop(name, None)
+        self._rankings.pop(name, None)
+        self.version += 1
+
+    def rule_order(self) -> dict:
+        """Returns the current try order as {name: ['lhs -> rhs', ...]}, for save_order."""
+        return {name: [f"{rule.lhs_str} -> {rule.rhs_str}" for rule in rule_list]
+                for name, rule_list in self.rules.items()}
+
+    def apply_rule_order(self, order: dict) -> None:
+        """
+        Applies an order from rule_order(). Rules it does not list keep their relative
+        order after the listed ones. Raises ValueError if the order would put a rule
+        before an overlapping rule that comes earlier in the file.
+        """
+        for name, texts in order.items():
+            rule_list = self.rules.get(name)
+            if rule_list is None:
+                continue
+            by_text = {f"{rule.lhs_str} -> {rule.rhs_str}": rule for rule in sorted(rule_list, key=lambda r: -r.rule_id)}
+            ordered = [by_text.pop(text) for text in texts if text in by_text]
+            ordered += [rule for rule in rule_list if rule not in ordered]
+            before = self._overlap_graph(name)
+            for i, rule in enumerate(ordered):
+                for later in ordered[i + 1:]:
+                    if later.rule_id in before[rule.rule_id]:
+                        raise ValueError(f"Unsafe order for {name}: '{rule.lhs_str}' cannot come "
+                                         f"before the overlapping '{later.lhs_str}'")
+            if ordered != rule_list:
+                self._set_order(name, ordered)
+
+    def save_order(self, path: str) -> None:
+        """Writes the current rule order as JSON, e.g. next to the rule file."""
+        with open(path, 'w', encoding='utf-8') as stream:
+            json.dump(self.rule_order(), stream, indent=2)
+
+    def load_order(self, path: str) -> None:
+        with open(path, encoding='utf-8') as stream:
+            self.apply_rule_order(json.load(stream))
+
+    def candidates(self, node: Function) -> list:
+        """Returns the rules for node's name whose patterns can match node, in the order they are tried."""
+        tree = self.index.get(node.name)
+        if tree is None:
+            rule_list = self.rules.get(node.name)
+            if not rule_list:
+                return ()
+            # Indexing lazily keeps loading a large rule set cheap when few names are used.
+            tree = self.index[node.name] = DiscriminationTree()
+            for rule in rule_list:
+                tree.insert(rule.lhs, rule)
+        return tree.candidates(node)
+
+    def __getstate__(self):
+        # Pickled with the parsed sides, so a rule set shipped to another process is
+        # rebuilt without re-parsing; the index and compiled rewriter are rebuilt there.
+        return {
+            'names': list(self.rules),
+            'rules': [(rule.name, rule.lhs_str, rule.rhs_str, rule.lhs, rule.rhs) for rule in self.rules_by_id],
+            'arities': self.arities,
+            'assignments': self.assignments,
+            'order': {name: [rule.rule_id for rule in rule_list] for name, rule_list in self.rules.items()},
+            'builtins': self.builtins,
+            'strategies': self.strategies,
+        }
+
+    def __setstate__(self, state):
+        self.__init__({name: [] for name in state['names']}, state['arities'], state['assignments'],
+                      state.get('strategies'))
+        for rule in state['rules']:
+            self.add_rule(*rule)
+        for name, rule_ids in state.get('order', {}).items():
+            ordered = [self.rules_by_id[rule_id] for rule_id in rule_ids]
+            if ordered != self.rules[name]:
+                self._set_order(name, ordered)
+        if 'builtins' in state:
+            self.builtins = state['builtins']
+        self.version = 0
+
+    def rewriter(self, backend: str = 'interpreted'):
+        """
+        Returns a function that rewrites a node at its root: it takes a Function node and
+        returns (rule, transformed_node) for the first matching rule, or None.
+        The 'compiled' rewriter is generated once per rule set version.
+        """
+        if backend == 'interpreted':
+            return functools.partial(rewrite_at_root, rules=self)
+        if backend == 'compiled':
+            if self._compiled is None or self._compiled[0] != self.version:
+                self._compiled = (self.version, compile_rewriter(self))
+            return self._compiled[1]
+        raise ValueError(f"Unknown matching backend: {backend}")
+
+    def __len__(self):
+        return len(self.rules_by_id)
+
+    def __repr__(self):
+        return f"RuleSet({len(self.rules_by_id)} rules, {len(self.rules)} symbols)"
+
+def compile_rules(rules) -> RuleSet:
+    """
+    Returns a RuleSet for the given rules, which may be a rules-and-assignments string,
+    a rule dict as returned by parse_rules, or an already compiled RuleSet.
+    """
+    if isinstance(rules, RuleSet):
+        return rules
+    if isinstance(rules, str):
+        return RuleSet.from_string(rules)
+    if isinstance(rules, dict):
+        return RuleSet(rules)
+    raise TypeError(f"Cannot compile rules from {type(rules).__name__}")
+
 def substitute_variables(ast: Term, assignments: dict) -> Term:
-    if isinstance(ast, Constant):
+    if isinstance(ast, Variable):
+        return assignments.get(ast.name, ast) # The assigned node, or the variable itself
+    if isinstance(ast, Constant) or not assignments:
         return ast
-    elif isinstance(ast, Variable):
-        if ast.name in assignments:
-            return assignments[ast.name] # Return the assigned Constant node
+
+    # Rebuild functions bottom-up with an explicit stack; each distinct node is visited once.
+    results = {}
+    stack = [ast]
+    while stack:
+        node = stack[-1]
+        if node in results:
+            stack.pop()
+        elif isinstance(node, Constant):
+            results[node] = node
+            stack.pop()
+        elif isinstance(node, Variable):
+            results[node] = assignments.get(node.name, node)
+            stack.pop()
+        elif isinstance(node, Function):
+            pending = [arg for arg in node.args if arg not in results]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            results[node] = Function(node.name, [results[arg] for arg in node.args])
         else:
-            return ast # Variable not in assignments, return as is
-    elif isinstance(ast, Function):
-        new_args = [substitute_variables(arg, assignments) for arg in ast.args]
-        return Function(ast.name, new_args)
-    else:
-        raise ValueError(f"Unknown term type during substitution: {type(ast)}")
+            raise ValueError(f"Unknown term type during substitution: {type(node)}")
+    return results[ast]
 
 def match_pattern(pattern: Term, target: Term, bindings: dict) -> bool:
     """
     Attempts to match a pattern AST against a target AST, populating bindings.
     Returns True if a match is found, False otherwise.
     """
-    if isinstance(pattern, Constant):
-        return isinstance(target, Constant) and pattern.value == target.value
-    elif isinstance(pattern, Variable):
-        # If variable is already bound, check if target matches the bound value
-        if pattern.name in bindings:
-            return target == bindings[pattern.name]
-        else:
-            # Bind the variable to the target
-            bindings[pattern.name] = target
-            return True
-    elif isinstance(pattern, Function):
+    if isinstance(pattern, Variable):
+        bound = bindings.setdefault(pattern.name, target)
+        return bound is target
+    if not isinstance(pattern, Function):
+        return pattern is target # Terms are interned, so equal constants are identical
+
+    # Leaf arguments are checked in place; nested function patterns wait on a stack.
+    stack = []
+    while True:
         if not isinstance(target, Function) or pattern.name != target.name or len(pattern.args) != len(target.args):
             return False
-        # Recursively match arguments
         for p_arg, t_arg in zip(pattern.args, target.args):
-            if not match_pattern(p_arg, t_arg, bindings):
+            if isinstance(p_arg, Variable):
+                # If variable is already bound, check if target matches the bound value
+                bound = bindings.get(p_arg.name)
+                if bound is None:
+                    bindings[p_arg.name] = t_arg
+                elif bound is not t_arg:
+                    return False
+            elif isinstance(p_arg, Function):
+                stack.append((p_arg, t_arg))
+            elif p_arg is not t_arg:
                 return False
-        return True
-    return False
+        if not stack:
+            return True
+        pattern, target = stack.pop()
+
+def rewrite_at_root(node: Function, rules: RuleSet):
+    """
+    Tries the rules for node's name against node itself (not its subterms), then the
+    rule set's builtin for the name, if any.
+    Returns (rule, transformed_node) for the first rule that matches, or None.
+    """
+    for rule in rules.candidates(node): # Only consider indexed rules that can match this node
+        bindings = {}
+        if match_pattern(rule.lhs, node, bindings):
+            # Apply the rule: substitute variables in RHS with bound values
+            return rule, substitute_variables(rule.rhs, bindings)
+    return _apply_builtin(node, rules.builtins)
+
+def _apply_builtin(node: Function, builtins: dict):
+    builtin = builtins.get(node.name)
+    if builtin is None:
+        return None
+    transformed_node = builtin.apply(node)
+    if transformed_node is None:
+        return None
+    return builtin, transformed_node
+
+# --- Compiled Matching Backend ---
+# Rules can be turned into generated Python source with one function per function name.
+# Each function tests the rules for that name in file order, with the pattern checks
+# (constants by identity, nested function names and arities, repeated variables) and the
+# construction of the replacement written out inline.
+def _pattern_conditions(pattern: Function, conditions: list, bindings: dict, ref) -> None:
+    """
+    Appends Python conditions matching the arguments of pattern against node.args, in
+    preorder so every access is guarded by the checks on its parents. bindings maps each
+    pattern variable to the expression for its first occurrence.
+    """
+    pending = [(arg, f"a[{i}]") for i, arg in reversed(list(enumerate(pattern.args)))]
+    while pending:
+        term, expr = pending.pop()
+        if isinstance(term, Variable):
+            if term.name in bindings:
+                conditions.append(f"{expr} is {bindings[term.name]}")
+            else:
+                bindings[term.name] = expr
+        elif isinstance(term, Function):
+            conditions.append(f"{expr}.__class__ is Function and {expr}.name == {term.name!r}"
+                              f" and len({expr}.args) == {len(term.args)}")
+            pending.extend((arg, f"{expr}.args[{i}]") for i, arg in reversed(list(enumerate(term.args))))
+        else:
+            conditions.append(f"{expr} is {ref(term)}")
+
+def _replacement_expression(rhs: Term, bindings: dict, ref) -> str:
+    """Returns a Python expression building rhs from the bound subterms."""
+    if is_ground(rhs):
+        return ref(rhs) # Prebuilt once; terms are interned and immutable
+    if isinstance(rhs, Variable):
+        return bindings[rhs.name] if rhs.name in bindings else ref(rhs)
+    args = ", ".join(_replacement_expression(arg, bindings, ref) for arg in rhs.args)
+    return f"Function({rhs.name!r}, ({args},))"
 
-def apply_single_rule_pass(current_ast: Term, rules: dict, ast_trace: list) -> tuple[Term, bool]:
+def generate_rewriter_source(rules: RuleSet) -> tuple[str, dict]:
+    """
+    Returns the generated source for rules and the namespace of prebuilt terms and Rule
+    objects it refers to. The source defines rewrite_by_name, mapping each function name
+    to its rewrite function.
+    """
+    namespace = {'Function': Function}
+    names = {}
+
+    def ref(obj):
+        if id(obj) not in names:
+            names[id(obj)] = f"_k{len(names)}"
+            namespace[names[id(obj)]] = obj
+        return names[id(obj)]
+
+    lines = []
+    dispatch = []
+    for symbol_index, (name, rule_list) in enumerate(rules.rules.items()):
+        func_name = f"_rewrite_{symbol_index}"
+        dispatch.append(f"    {name!r}: {func_name},")
+        lines.append(f"def {func_name}(node): # {name!r}")
+        lines.append("    a = node.args")
+        for rule in rule_list:
+            lhs = rule.lhs
+            lines.append(f"    # {rule.lhs_str!r} -> {rule.rhs_str!r}")
+            if isinstance(lhs, Variable):
+                bindings = {lhs.name: "node"}
+                lines.append(f"    return {ref(rule)}, {_replacement_expression(rule.rhs, bindings, ref)}")
+                break # Matches every node, so later rules are unreachable
+            if not isinstance(lhs, Function) or lhs.name != name:
+                continue # Can never match a node with this name
+            conditions = [f"len(a) == {len(lhs.args)}"]
+            bindings = {}
+            _pattern_conditions(lhs, conditions, bindings, ref)
+            lines.append(f"    if {' and '.join(conditions)}:")
+            lines.append(f"        return {ref(rule)}, {_replacement_expression(rule.rhs, bindings, ref)}")
+        lines.append("    return None")
+        lines.append("")
+    lines.append("rewrite_by_name = {")
+    lines.extend(dispatch)
+    lines.append("}")
+    return "\n".join(lines) + "\n", namespace
+
+def compile_rewriter(rules: RuleSet):
+    """
+    Compiles rules into a root rewriter with the same contract as rewrite_at_root:
+    it takes a Function node and returns (rule, transformed_node) or None.
+    The generated source is available as the returned function's source attribute.
+    """
+    source, namespace = generate_rewriter_source(rules)
+    exec(compile(source, f"<rewriter for {rules!r}>", 'exec'), namespace)
+    rewrite_by_name = namespace['rewrite_by_name']
+    builtins = rules.builtins
+
+    def rewrite(node: Function):
+        rewrite_symbol = rewrite_by_name.get(node.name)
+        if rewrite_symbol is not None:
+            step = rewrite_symbol(node)
+            if step is not None:
+                return step
+        return _apply_builtin(node, builtins)
+
+    rewrite.source = source
+    return rewrite
+
+# --- Profiling ---
+class EvaluationStats:
+    """
+    Opt-in profiling for evaluate(stats=...), normalize and apply_single_rule_pass.
+    Collects, per rule: match attempts, successful matches, seconds in match_pattern and
+    seconds in substitution; per function name: root rewrite calls, rewrites and seconds;
+    and the number of nodes handled by each pass. The optional callbacks are called as
+      on_match(node, rule, bindings), on_rewrite(before, rule, after) and
+      on_pass(pass_number, node_count).
+    Nothing is measured when no stats object is passed. With the compiled backend the
+    per-rule attempts and match times are not available; per-name times still are.
+    """
+    def __init__(self, on_match=None, on_rewrite=None, on_pass=None):
+        self.on_match = on_match
+        self.on_rewrite = on_rewrite
+        self.on_pass = on_pass
+        self.rules = {}    # rule_id -> [rule, attempts, matches, match seconds, substitution seconds]
+        self.symbols = {}  # name -> [calls, rewrites, seconds]
+        self.pass_nodes = []
+
+    def _rule_entry(self, rule) -> list:
+        entry = self.rules.get(rule.rule_id)
+        if entry is None:
+            entry = self.rules[rule.rule_id] = [rule, 0, 0, 0.0, 0.0]
+        return entry
+
+    def _symbol_entry(self, name: str) -> list:
+        entry = self.symbols.get(name)
+        if entry is None:
+            entry = self.symbols[name] = [0, 0, 0.0]
+        return entry
+
+    def wrap(self, rules: RuleSet, backend: str = 'interpreted'):
+        """Returns a rewriter like RuleSet.rewriter(backend) that records into these stats."""
+        perf_counter = time.perf_counter
+        if backend == 'interpreted':
+            def rewrite(node: Function):
+                symbol = self._symbol_entry(node.name)
+                symbol[0] += 1
+                start = perf_counter()
+                for rule in rules.candidates(node):
+                    entry = self._rule_entry(rule)
+                    bindings = {}
+                    match_start = perf_counter()
+                    matched = match_pattern(rule.lhs, node, bindings)
+                    entry[1] += 1
+                    entry[3] += perf_counter() - match_start
+                    if matched:
+                        entry[2] += 1
+                        if self.on_match is not None:
+                            self.on_match(node, rule, bindings)
+                        substitute_start = perf_counter()
+                        transformed_node = substitute_variables(rule.rhs, bindings)
+                        entry[4] += perf_counter() - substitute_start
+                        symbol[1] += 1
+                        symbol[2] += perf_counter() - start
+                        if self.on_rewrite is not None:
+                            self.on_rewrite(node, rule, transformed_node)
+                        return rule, transformed_node
+                step = _apply_builtin(node, rules.builtins)
+                if step is not None:
+                    self._rule_entry(step[0])[2] += 1
+                    symbol[1] += 1
+                    if self.on_rewrite is not None:
+                        self.on_rewrite(node, *step)
+                symbol[2] += perf_counter() - start
+                return step
+            return rewrite
+
+        inner = rules.rewriter(backend)
+        def rewrite(node: Function):
+            symbol = self._symbol_entry(node.name)
+            symbol[0] += 1
+            start = perf_counter()
+            step = inner(node)
+            symbol[2] += perf_counter() - start
+            if step is not None:
+                rule, transformed_node = step
+                self._rule_entry(rule)[2] += 1
+                symbol[1] += 1
+                if self.on_rewrite is not None:
+                    self.on_rewrite(node, rule, transformed_node)
+            return step
+        return rewrite
+
+    def record_pass(self, node_count: int) -> None:
+        self.pass_nodes.append(node_count)
+        if self.on_pass is not None:
+            self.on_pass(len(self.pass_nodes), node_count)
+
+    def rule_rows(self) -> list:
+        """Returns a dict per rule that was tried, slowest first."""
+        rows = [{'rule_id': rule.rule_id, 'rule': f"{rule.lhs_str} -> {rule.rhs_str}", 'attempts': attempts,
+                 'matches': matches, 'match_seconds': match_seconds, 'substitute_seconds': substitute_seconds}
+                for rule, attempts, matches, match_seconds, substitute_seconds in self.rules.values()]
+        rows.sort(key=lambda row: row['match_seconds'] + row['substitute_seconds'], reverse=True)
+        return rows
+
+    def symbol_rows(self) -> list:
+        """Returns a dict per function name that rules were tried on, slowest first."""
+        rows = [{'symbol': name, 'calls': calls, 'rewrites': rewrites, 'seconds': seconds}
+                for name, (calls, rewrites, seconds) in self.symbols.items()]
+        rows.sort(key=lambda row: row['seconds'], reverse=True)
+        return rows
+
+    def report(self) -> str:
+        lines = [f"{'symbol':<20} {'calls':>10} {'rewrites':>10} {'seconds':>10}"]
+        for row in self.symbol_rows():
+            lines.append(f"{row['symbol']:<20} {row['calls']:>10} {row['rewrites']:>10} {row['seconds']:>10.6f}")
+        lines.append("")
+        lines.append(f"{'rule':<40} {'attempts':>10} {'matches':>10} {'match s':>10} {'subst s':>10}")
+        for row in self.rule_rows():
+            lines.append(f"{row['rule']:<40} {row['attempts']:>10} {row['matches']:>10} "
+                         f"{row['match_seconds']:>10.6f} {row['substitute_seconds']:>10.6f}")
+        lines.append("")
+        lines.append(f"nodes per pass: {self.pass_nodes}")
+        return "\n".join(lines)
+
+def _rewriter_for(rules: RuleSet, backend: str, stats: EvaluationStats,
+                  limits: "EvaluationLimits" = None, normal_forms: dict = None):
+    rewrite = rules.rewriter(backend) if stats is None else stats.wrap(rules, backend)
+    return rewrite if limits is None else limits.wrap(rewrite, normal_forms)
+
+# --- Evaluation Limits ---
+class EvaluationLimitError(RuntimeError):
+    """
+    Raised when an evaluation is stopped before reaching a normal form. term is the
+    partially rewritten term at that point and trace the trace so far (as evaluate would
+    have returned it).
+    """
+    def __init__(self, message: str, term: Term = None, trace=None):
+        super().__init__(message)
+        self.term = term
+        self.trace = trace
+
+    def __reduce__(self):
+        return self.__class__, (self.args[0], self.term, self.trace)
+
+class StepLimitExceeded(EvaluationLimitError):
+    """More rewrite steps were needed than max_steps allows."""
+
+class DeadlineExceeded(EvaluationLimitError):
+    """The evaluation ran past its timeout."""
+
+class TermSizeExceeded(EvaluationLimitError):
+    """A term grew beyond max_size nodes (counted as a tree, see Term.size)."""
+
+class RewriteCycleError(EvaluationLimitError):
+    """A term was reached again while it was still being normalized, so rewriting cannot terminate."""
+
+class EvaluationLimits:
+    """
+    Bounds on one evaluation, checked as rules are applied: at most max_steps rewrite
+    steps, at most timeout seconds of wall-clock time (checked every check_interval root
+    rewrite attempts), and no term larger than max_size. With detect_cycles, a node that
+    is rewritten a second time before its normal form is known is reported as a cycle
+    (costing a set lookup per step); between passes, a whole term seen before is.
+    A limits object keeps its step count, deadline and count of rewrite attempts until
+    start() is called again, so the deadline is checked across the passes of a pass-based
+    strategy that wraps its rewriter once per pass.
+    """
+    def __init__(self, max_steps: int = None, timeout: float = None, max_size: int = None,
+                 detect_cycles: bool = False, check_interval: int = 64):
+        self.max_steps = max_steps
+        self.timeout = timeout
+        self.max_size = max_size
+        self.detect_cycles = detect_cycles
+        self.check_interval = check_interval
+        self.start()
+
+    def start(self) -> None:
+        self.steps = 0
+        self.attempts = 0
+        self.deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        self.seen_terms = set()
+
+    def wrap(self, rewrite, normal_forms: dict = None):
+        """
+        Returns rewrite with the limits checked around each call. Cycles are only looked
+        for given normal_forms, the normalizer's table of nodes it has finished.
+        """
+        max_steps = self.max_steps
+        max_size = self.max_size
+        check_interval = self.check_interval
+        rewritten = set() if self.detect_cycles and normal_forms is not None else None
+
+        def limited_rewrite(node: Function):
+            if self.deadline is not None:
+                self.attempts += 1
+                if self.attempts % check_interval == 0 and time.monotonic() > self.deadline:
+                    raise DeadlineExceeded(f"Evaluation exceeded its timeout of {self.timeout} seconds")
+            if max_size is not None and node.size > max_size:
+                raise TermSizeExceeded(f"Term of size {node.size} exceeds the limit of {max_size}")
+            step = rewrite(node)
+            if step is None:
+                return None
+            if max_steps is not None and self.steps >= max_steps:
+                raise StepLimitExceeded(f"Evaluation needed more than {max_steps} rewrite steps")
+            if max_size is not None and step[1].size > max_size:
+                raise TermSizeExceeded(f"Term of size {step[1].size} exceeds the limit of {max_size}")
+            if rewritten is not None:
+                if node in rewritten and node not in normal_forms:
+                    raise RewriteCycleError(f"Rewriting cycle: {format_term(node)} was reached again "
+                                            f"before it was normalized")
+                rewritten.add(node)
+            self.steps += 1
+            return step
+        return limited_rewrite
+
+    def check_term(self, term: Term) -> None:
+        """Checks a whole term between passes: its size and, with detect_cycles, whether it was seen before."""
+        if self.max_size is not None and term.size > self.max_size:
+            raise TermSizeExceeded(f"Term of size {term.size} exceeds the limit of {self.max_size}", term)
+        if self.detect_cycles:
+            if term in self.seen_terms:
+                raise RewriteCycleError(f"Rewriting cycle: {format_term(term)} was reached again", term)
+            self.seen_terms.add(term)
+
+def _partial_term(term: Term, frames) -> Term:
+    """
+    Rebuilds the whole term around term, the subterm being worked on, from the frames
+    (node, normalized arguments so far) of its ancestors, innermost first.
+    """
+    for node, new_args in frames:
+        term = Function(node.name, new_args + [term] + list(node.args[len(new_args) + 1:]))
+    return term
+
+# --- Trace Recording ---
+TRACE_LEVELS = ('off', 'counts', 'compact', 'full')
+
+class TraceRecorder:
+    """
+    Receives every rewrite step from the rewriters. What is kept depends on level:
+      'counts'  - only the number of steps per rule id (always kept, in counts)
+      'compact' - a (rule_id, path) record per step, where path is the tuple of argument
+                  positions leading from the root of the term to the rewritten node
+      'full'    - a (before, lhs, rhs, after) record per step, as in the original trace
+    With limit, only the last limit records are kept. With sink (a text file), each
+    record is also written to it as a JSON line as soon as it happens, and without limit
+    no records are kept in memory at all; the terms of full
+    records are written with at most sink_term_limit nodes each (see format_term), since
+    a term with shared subterms written out in full can be exponentially large.
+    The rewriters are given no recorder at all for level 'off', so an untraced
+    evaluation does no per-step work for tracing.
+    """
+    def __init__(self, level: str = 'full', limit: int = None, sink=None, steps: list = None,
+                 sink_term_limit: int = 10_000):
+        if level not in TRACE_LEVELS:
+            raise ValueError(f"Unknown trace level: {level}")
+        self.level = level
+        self.sink = sink
+        self.sink_term_limit = sink_term_limit
+        self.counts = {}
+        if steps is not None:
+            self.steps = steps
+        elif limit is not None:
+            self.steps = deque(maxlen=limit)
+        elif sink is not None:
+            self.steps = deque(maxlen=0) # The sink has every record
+        else:
+            self.steps = []
+        self.needs_path = level == 'compact'
+
+    def record(self, before: Term, rule, after: Term, path: tuple = None) -> None:
+        self.counts[rule.rule_id] = self.counts.get(rule.rule_id, 0) + 1
+        if self.level == 'full':
+            step = (before, rule.lhs_str, rule.rhs_str, after)
+            self.steps.append(step)
+            if self.sink is not None:
+                limit = self.sink_term_limit
+                self.sink.write(json.dumps({'rule': rule.rule_id, 'before': format_term(before, limit),
+                                            'after': format_term(after, limit)}) + "\n")
+        elif self.level == 'compact':
+            self.steps.append((rule.rule_id, path))
+            if self.sink is not None:
+                self.sink.write(json.dumps({'rule': rule.rule_id, 'path': path}) + "\n")
+
+    def result(self):
+        """The trace returned by evaluate: the step counts for 'counts', else the records."""
+        if self.level == 'counts':
+            return dict(self.counts)
+        return list(self.steps)
+
+def _as_recorder(trace):
+    """Accepts a TraceRecorder, a list to append full records to, or None."""
+    if trace is None or isinstance(trace, TraceRecorder):
+        return trace
+    return TraceRecorder('full', steps=trace)
+
+def apply_single_rule_pass(current_ast: Term, rules, ast_trace: list,
+                           backend: str = 'interpreted', stats: EvaluationStats = None,
+                           limits: EvaluationLimits = None) -> tuple[Term, bool]:
     """
     Attempts to apply one rule in a single pass over the AST.
+    rules may be a RuleSet or a rule dict as returned by parse_rules.
+    ast_trace is a list that full trace records are appended to, a TraceRecorder or None.
     Returns the modified AST and a boolean indicating if any change occurred.
+    A subterm shared by several parents is handled once per pass, so every occurrence of
+    it is rewritten by one step.
+    With limits (an EvaluationLimits), an EvaluationLimitError is raised when one is
+    exceeded, with the term as it was at that point.
     """
     changed = False
-    
-    # Helper to recursively apply rules
-    def _apply_recursive(node: Term) -> Term:
-        nonlocal changed
+    rewrite = _rewriter_for(compile_rules(rules), backend, stats, limits)
+    if stats is not None:
+        stats.record_pass(current_ast.size)
+    recorder = _as_recorder(ast_trace)
+    new_ast = None
+    done = {} # Distinct node -> what it became in this pass
+
+    # Each frame is a node and its arguments after this pass; arguments are handled first.
+    stack = [(current_ast, [])]
+    while stack:
+        node, new_args = stack[-1]
+        if isinstance(node, Function) and len(new_args) < len(node.args):
+            arg = node.args[len(new_args)]
+            arg_result = done.get(arg)
+            if arg_result is None:
+                stack.append((arg, []))
+            else:
+                new_args.append(arg_result)
+            continue
+        stack.pop()
+        original = node
+
         if isinstance(node, Function):
-            # First, apply rules to arguments
-            new_args = []
-            for arg in node.args:
-                new_arg = _apply_recursive(arg)
-                if new_arg != arg: # Check if argument changed
-                    changed = True
-                new_args.append(new_arg)
-            node = Function(node.name, new_args) # Create new function node with potentially changed args
+            if any(new_arg is not arg for new_arg, arg in zip(new_args, node.args)):
+                changed = True
+                node = Function(node.name, new_args) # Create new function node with the changed args
 
             # Then, try to apply rules to the current function node itself
-            for rule_name, rule_list in rules.items():
-                if node.name == rule_name: # Only consider rules for the current function's name
-                    for lhs_str, rhs_str in rule_list:
-                        lhs_ast = parse_expression(lhs_str)
-                        rhs_ast = parse_expression(rhs_str)
-                        
-                        bindings = {}
-                        if match_pattern(lhs_ast, node, bindings):
-                            # Apply the rule: substitute variables in RHS with bound values
-                            transformed_node = substitute_variables(rhs_ast, bindings)
-                            ast_trace.append((node, lhs_str, rhs_str, transformed_node)) # Record the transformation
-                            changed = True
-                            return transformed_node # Return the transformed node and stop for this rule
-        return node # No rule applied or not a Function node
-
-    new_ast = _apply_recursive(current_ast)
+            try:
+                step = rewrite(node)
+            except EvaluationLimitError as error:
+                error.term = _partial_term(node, reversed(stack))
+                raise
+            if step is not None:
+                rule, transformed_node = step
+                if recorder is not None: # Record the transformation
+                    path = tuple(len(frame[1]) for frame in stack) if recorder.needs_path else None
+                    recorder.record(node, rule, transformed_node, path)
+                changed = True
+                node = transformed_node # Stop for this node; the next pass continues from here
+
+        done[original] = node
+        if stack:
+            stack[-1][1].append(node)
+        else:
+            new_ast = node
+
     return new_ast, changed
 
-def evaluate(expression_string: str, rules_and_assignments_string: str) -> tuple[Term, list]:
-    rules, arities, assignments = parse_rules_and_assignments(rules_and_assignments_string)
-    
+# --- Normalization Strategies ---
+# Both normalizers keep an explicit stack of frames rather than recursing, so terms of any
+# depth can be normalized. normal_forms maps every term already normalized to its normal
+# form (normal forms map to themselves), so subterms known to be normal are never walked
+# again and, after a rewrite, only the new node and its ancestors are re-examined.
+# rewrite(node) returns (rule, transformed_node) or None; see RuleSet.rewriter().
+# recorder is a TraceRecorder or None; a rewritten node's path is read off the frame stack.
+def _normalize_innermost(term: Term, rewrite, recorder: TraceRecorder, normal_forms: dict) -> Term:
+    """Rewrites term to normal form, arguments first, in a single traversal."""
+    result = normal_forms.get(term)
+    if result is not None:
+        return result
+
+    # Frame: the term being normalized, the normal forms of its arguments so far, and the
+    # terms it was rewritten from (which share its normal form).
+    stack = [(term, [], None)]
+    while stack:
+        term, new_args, rewritten_from = stack[-1]
+        if isinstance(term, Function) and len(new_args) < len(term.args):
+            arg = term.args[len(new_args)]
+            arg_result = normal_forms.get(arg)
+            if arg_result is None:
+                stack.append((arg, [], None))
+            else:
+                new_args.append(arg_result)
+            continue
+        stack.pop()
+
+        node = term
+        result = term
+        if isinstance(term, Function):
+            if any(new_arg is not arg for new_arg, arg in zip(new_args, term.args)):
+                node = Function(term.name, new_args)
+            # A node rebuilt from normalized arguments may have been normalized already
+            known = normal_forms.get(node) if node is not term else None
+            step = None
+            if known is not None:
+                result = known
+            else:
+                result = node
+                try:
+                    step = rewrite(node)
+                except EvaluationLimitError as error:
+                    error.term = _partial_term(node, ((frame[0], frame[1]) for frame in reversed(stack)))
+                    raise
+            if step is not None:
+                rule, transformed_node = step
+                if recorder is not None:
+                    path = tuple(len(frame[1]) for frame in stack) if recorder.needs_path else None
+                    recorder.record(node, rule, transformed_node, path)
+                result = normal_forms.get(transformed_node)
+                if result is None:
+                    # Normalize the new node in this frame's place; its bound subterms are
+                    # already in normal_forms and are skipped.
+                    # This frame was popped, so its list is extended in place
+                    rewritten_from = rewritten_from or []
+                    rewritten_from += (term, node)
+                    stack.append((transformed_node, [], rewritten_from))
+                    continue
+
+        normal_forms[term] = result
+        normal_forms[node] = result
+        normal_forms[result] = result
+        if rewritten_from:
+            for earlier in rewritten_from:
+                normal_forms[earlier] = result
+        if stack:
+            stack[-1][1].append(result)
+    return result
+
+def _normalize_outermost(term: Term, rewrite, recorder: TraceRecorder, normal_forms: dict) -> Term:
+    """
+    Rewrites term to normal form trying each node before its arguments.
+    Arguments are only normalized once no rule applies at the node itself, and the node
+    is retried whenever one of its arguments changed.
+    """
+    result = normal_forms.get(term)
+    if result is not None:
+        return result
+
+    # Frame: [original term, current term, normal forms of its arguments so far, terms
+    # rewritten on the way]; the argument list is None until no rule applies at the
+    # current term.
+    stack = [[term, term, None, []]]
+    while stack:
+        frame = stack[-1]
+        original, term, new_args, _ = frame
+        if new_args is None:
+            while True:
+                result = normal_forms.get(term)
+                if result is not None or not isinstance(term, Function):
+                    break
+                try:
+                    step = rewrite(term)
+                except EvaluationLimitError as error:
+                    error.term = _partial_term(term, ((frame[1], frame[2]) for frame in reversed(stack[:-1])))
+                    raise
+                if step is None:
+                    break
+                rule, transformed_node = step
+                if recorder is not None:
+                    path = tuple(len(frame[2]) for frame in stack[:-1]) if recorder.needs_path else None
+                    recorder.record(term, rule, transformed_node, path)
+                frame[3].append(term)
+                term = transformed_node
+            if result is None and isinstance(term, Function):
+                frame[1] = term
+                frame[2] = []
+                continue
+            if result is None:
+                result = term
+        elif len(new_args) < len(term.args):
+            arg = term.args[len(new_args)]
+            arg_result = normal_forms.get(arg)
+            if arg_result is None:
+                stack.append([arg, arg, None, []])
+            else:
+                new_args.append(arg_result)
+            continue
+        elif any(new_arg is not arg for new_arg, arg in zip(new_args, term.args)):
+            # An argument changed, so the node may match now
+            frame[1] = Function(term.name, new_args)
+            frame[2] = None
+            continue
+        else:
+            result = term # No rule at the node and its arguments are normal, so it is normal
+
+        stack.pop()
+        normal_forms[original] = result
+        normal_forms[result] = result
+        for earlier in frame[3]: # Each of them has the same normal form
+            normal_forms[earlier] = result
+        if stack:
+            stack[-1][2].append(result)
+    return result
+
+@functools.lru_cache(maxsize=None)
+def _default_strategy(arity: int) -> tuple:
+    return tuple(range(1, arity + 1)) + (0,)
+
+def _normalize_strategic(term: Term, rewrite, recorder: TraceRecorder, normal_forms: dict,
+                         strategies: dict, arities: dict) -> Term:
+    """
+    The innermost strategy for rule sets with strat annotations (see RuleSet.set_strategy):
+    each node's arguments are normalized and its rules tried in the order its strategy
+    gives, and the node is rewritten as soon as a rule applies. A node whose number of
+    arguments differs from the strategy's arity (arities, by name) is evaluated by the
+    default strategy.
+    """
+    result = normal_forms.get(term)
+    if result is not None:
+        return result
+
+    # Frame: [the term being normalized, its node with the arguments normalized so far,
+    # the index of the next strategy step, the terms it was rewritten from, and the
+    # argument position being normalized below it].
+    stack = [[term, term, 0, None, None]]
+    while stack:
+        frame = stack[-1]
+        term, node, step, rewritten_from, waiting = frame
+        if waiting is not None:
+            if result is not node.args[waiting]:
+                args = list(node.args)
+                args[waiting] = result
+                node = Function(node.name, args)
+            frame[4] = None
+
+        result = node
+        if isinstance(node, Function):
+            strategy = strategies.get(node.name)
+            if strategy is None or len(node.args) != arities[node.name]:
+                strategy = _default_strategy(len(node.args))
+            while step < len(strategy):
+                position = strategy[step]
+                step += 1
+                if position:
+                    arg = node.args[position - 1]
+                    arg_result = normal_forms.get(arg)
+                    if arg_result is None:
+                        frame[1], frame[2], frame[4] = node, step, position - 1
+                        stack.append([arg, arg, 0, None, None])
+                        break
+                    if arg_result is not arg:
+                        args = list(node.args)
+                        args[position - 1] = arg_result
+                        node = Function(node.name, args)
+                    continue
+                known = normal_forms.get(node)
+                if known is not None:
+                    # A node rebuilt from normalized arguments that was normalized already
+                    result = known
+                    break
+                try:
+                    rewrite_step = rewrite(node)
+                except EvaluationLimitError as error:
+                    partial = node
+                    for parent in reversed(stack[:-1]):
+                        args = list(parent[1].args)
+                        args[parent[4]] = partial
+                        partial = Function(parent[1].name, args)
+                    error.term = partial
+                    raise
+                if rewrite_step is not None:
+                    rule, transformed_node = rewrite_step
+                    if recorder is not None:
+                        path = tuple(parent[4] for parent in stack[:-1]) if recorder.needs_path else None
+                        recorder.record(node, rule, transformed_node, path)
+                    result = normal_forms.get(transformed_node)
+                    if result is None:
+                        # Normalize the new node in this frame's place.
+                        # This frame is replaced, so its list is extended in place
+                        rewritten_from = rewritten_from or []
+                        rewritten_from += (term, node)
+                        stack[-1] = [transformed_node, transformed_node, 0, rewritten_from, None]
+                    break
+            else:
+                result = node
+            if stack[-1] is not frame:
+                continue
+
+        stack.pop()
+        # node is either result or the node a rule rewrote; evaluated afresh, its first
+        # 0 step would meet that same node and rule, so it shares the normal form.
+        normal_forms[term] = result
+        normal_forms[node] = result
+        normal_forms[result] = result
+        if rewritten_from:
+            for earlier in rewritten_from:
+                normal_forms[earlier] = result
+    return result
+
+_STRATEGIES = {
+    'innermost': _normalize_innermost,
+    'outermost': _normalize_outermost,
+}
+
+def _normalizer_for(rules: RuleSet, strategy: str):
+    """Returns the normalizer for strategy, following the rule set's strat annotations if it has any."""
+    if strategy == 'innermost' and rules.strategies:
+        return functools.partial(_normalize_strategic, strategies=rules.strategies,
+                                 arities=rules._strategy_arities)
+    return _STRATEGIES[strategy]
+
+# --- Normal Form Cache ---
+class NormalFormCache:
+    """
+    A size-bounded LRU cache of normal forms that can be shared across normalize and
+    evaluate calls. Entries are keyed on the rule set's uid and version, the strategy and
+    the (interned) term, so adding a rule to a RuleSet makes its old entries unreachable;
+    invalidate() drops them.
+    """
+    def __init__(self, maxsize: int = 100_000):
+        if maxsize <= 0:
+            raise ValueError("maxsize must be positive")
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, rules: RuleSet, strategy: str, term: Term):
+        """Returns the cached normal form of term, or None."""
+        key = (rules.uid, rules.version, strategy, term)
+        result = self._entries.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return result
+
+    def put(self, rules: RuleSet, strategy: str, term: Term, normal_form: Term) -> None:
+        key = (rules.uid, rules.version, strategy, term)
+        self._entries[key] = normal_form
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, rules: RuleSet = None) -> None:
+        """Drops the entries for rules, or every entry if rules is None."""
+        if rules is None:
+            self._entries.clear()
+            return
+        for key in [key for key in self._entries if key[0] == rules.uid]:
+            del self._entries[key]
+
+    def info(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._entries), 'maxsize': self.maxsize}
+
+    def __len__(self):
+        return len(self._entries)
+
+class _CachedNormalForms(dict):
+    """The per-call normal form table, backed by a NormalFormCache for terms it has not seen."""
+    def __init__(self, cache: NormalFormCache, rules: RuleSet, strategy: str):
+        super().__init__()
+        self.cache = cache
+        self.rules = rules
+        self.strategy = strategy
+
+    def get(self, term, default=None):
+        result = dict.get(self, term)
+        if result is None:
+            result = self.cache.get(self.rules, self.strategy, term)
+            if result is None:
+                return default
+            dict.__setitem__(self, term, result)
+        return result
+
+    def __setitem__(self, term, normal_form):
+        if dict.get(self, term) is not normal_form:
+            dict.__setitem__(self, term, normal_form)
+            self.cache.put(self.rules, self.strategy, term, normal_form)
+
+def normalize(term: Term, rules, ast_trace: list = None, strategy: str = 'innermost',
+              cache: NormalFormCache = None, backend: str = 'interpreted',
+              stats: EvaluationStats = None, limits: EvaluationLimits = None) -> Term:
+    """
+    Rewrites term to normal form using the given strategy ('innermost' or 'outermost').
+    Each rewrite is appended to ast_trace as (before, lhs, rhs, after) if a list is given,
+    or passed to it if it is a TraceRecorder.
+    With a cache, normal forms found by earlier calls are reused; rewrites inside a
+    cached subterm are then not repeated, so they do not appear in ast_trace either.
+    backend selects how rules are matched: 'interpreted' walks the pattern ASTs with
+    match_pattern, 'compiled' runs generated Python code (see compile_rewriter).
+    With stats (an EvaluationStats), rule matching is profiled and the whole normalization
+    is recorded as one pass over the distinct nodes it handled.
+    With limits (an EvaluationLimits), an EvaluationLimitError is raised when one is
+    exceeded, carrying the partially rewritten term.
+    """
+    if strategy not in _STRATEGIES:
+        raise ValueError(f"Unknown rewriting strategy: {strategy}")
+    rules = compile_rules(rules)
+    normal_forms = {} if cache is None else _CachedNormalForms(cache, rules, strategy)
+    rewrite = _rewriter_for(rules, backend, stats, limits, normal_forms)
+    result = _normalizer_for(rules, strategy)(term, rewrite, _as_recorder(ast_trace), normal_forms)
+    if limits is not None:
+        limits.check_term(result)
+    if stats is not None:
+        stats.record_pass(len(normal_forms))
+    return result
+
+def evaluate(expression_string: str, rules_and_assignments, strategy: str = 'innermost',
+             cache: NormalFormCache = None, backend: str = 'interpreted',
+             trace: str = 'full', trace_limit: int = None, trace_sink=None,
+             stats: EvaluationStats = None, adaptive: bool = False,
+             parse_cache: ParseCache = None, max_steps: int = None, timeout: float = None,
+             max_size: int = None, detect_cycles: bool = False) -> tuple[Term, list]:
+    """
+    Evaluates an expression to normal form. The expression is a string in prefix syntax or
+    an already built Term, e.g. from parse_infix_expression.
+    rules_and_assignments is either a rules-and-assignments string or a compiled RuleSet;
+    pass a RuleSet when evaluating many expressions against the same rules.
+    strategy is 'innermost' (the default), 'outermost', or 'passes' to repeat
+    apply_single_rule_pass over the whole tree until nothing changes.
+    An optional NormalFormCache reuses normal forms across calls (not used by 'passes').
+    backend is 'interpreted' (the default) or 'compiled'; both give the same results and traces.
+    trace is the TraceRecorder level: 'full' (the default) returns (before, lhs, rhs, after)
+    records, 'compact' returns (rule_id, path) records, 'counts' returns {rule_id: steps}
+    and 'off' returns an empty list. trace_limit keeps only the last N records and
+    trace_sink is a file each record is written to as it happens; the returned trace then
+    holds only the last trace_limit records, or none without it. trace may also be a
+    TraceRecorder, which is then returned as the trace.
+    stats is an optional EvaluationStats to profile rules and install callbacks on.
+    With adaptive, rule hits are added to the RuleSet's hit_counts and every
+    reorder_interval adaptive evaluations the rules are reordered by them (see
+    RuleSet.reorder); pass a RuleSet for this to carry across calls.
+    An optional ParseCache skips parsing expressions seen before.
+    max_steps, timeout (seconds), max_size (see Term.size) and detect_cycles bound the
+    evaluation (see EvaluationLimits); when one is exceeded, a StepLimitExceeded,
+    DeadlineExceeded, TermSizeExceeded or RewriteCycleError is raised, whose term and
+    trace attributes hold the partially rewritten term and the trace so far.
+    """
+    rules = compile_rules(rules_and_assignments)
+
     # Parse the initial expression
-    current_ast = parse_expression(expression_string)
+    if isinstance(expression_string, Term):
+        current_ast = expression_string
+    else:
+        current_ast = parse_expression(expression_string, parse_cache)
 
     # Apply assignments to the AST
-    current_ast = substitute_variables(current_ast, assignments)
+    current_ast = substitute_variables(current_ast, rules.assignments)
 
     # Initialize AST trace
-    ast_trace = []
+    if isinstance(trace, TraceRecorder):
+        recorder = trace
+    elif trace == 'off':
+        recorder = TraceRecorder('counts') if adaptive else None
+    else:
+        recorder = TraceRecorder(trace, trace_limit, trace_sink)
+    counts_before = dict(recorder.counts) if adaptive else None
+    limits = None
+    if max_steps is not None or timeout is not None or max_size is not None or detect_cycles:
+        limits = EvaluationLimits(max_steps, timeout, max_size, detect_cycles)
+
+    try:
+        if strategy == 'passes':
+            # Apply rules iteratively until no more changes
+            changed = True
+            while changed:
+                current_ast, changed = apply_single_rule_pass(current_ast, rules, recorder, backend, stats, limits)
+                if limits is not None and changed:
+                    limits.check_term(current_ast)
+        else:
+            current_ast = normalize(current_ast, rules, recorder, strategy, cache, backend, stats, limits)
+    except EvaluationLimitError as error:
+        if recorder is None or trace == 'off':
+            error.trace = []
+        else:
+            error.trace = recorder if recorder is trace else recorder.result()
+        raise
+
+    if adaptive:
+        rules.record_hits({rule_id: count - counts_before.get(rule_id, 0)
+                           for rule_id, count in recorder.counts.items()})
+        rules.evaluations_since_reorder += 1
+        if rules.evaluations_since_reorder >= rules.reorder_interval:
+            rules.evaluations_since_reorder = 0
+            rules.reorder()
+
+    if recorder is None or trace == 'off':
+        return current_ast, []
+    if recorder is trace:
+        return current_ast, recorder
+    return current_ast, recorder.result()
 
-    # Apply rules iteratively until no more changes
-    changed = True
-    while changed:
-        current_ast, changed = apply_single_rule_pass(current_ast, rules, ast_trace)
+# --- Incremental Evaluation ---
+class EvaluationSession:
+    """
+    Keeps one expression in normal form while the values of its variables change.
+
+        session = EvaluationSession("And(x, Or(y, z))", rules)
+        session.result                      # Under rules.assignments
+        result, trace = session.update(x=False, y="Not(z)")
+
+    The session keeps, for every distinct node of the expression, its assigned version,
+    and for each variable the nodes that contain it. An update rebuilds only those nodes
+    for the changed variables and normalizes the new term against the normal forms kept
+    from earlier updates, so only the paths from the changed variables to the root are
+    rewritten and the trace holds just those steps. Setting a variable back to an earlier
+    value finds the earlier normal forms again.
+    Normal forms are kept in a dict that is cut back to the current nodes whenever it has
+    grown past compact_factor times its size after the last cut.
+    """
+    def __init__(self, expression, rules, strategy: str = 'innermost', backend: str = 'interpreted',
+                 trace: str = 'full', compact_factor: int = 4):
+        if strategy not in _STRATEGIES:
+            raise ValueError(f"Unknown rewriting strategy: {strategy}")
+        if trace not in TRACE_LEVELS:
+            raise ValueError(f"Unknown trace level: {trace}")
+        self.rules = compile_rules(rules)
+        self.strategy = strategy
+        self.backend = backend
+        self.trace = trace
+        self.compact_factor = compact_factor
+        self.expression = expression if isinstance(expression, Term) else parse_expression(expression)
+        self.assignments = dict(self.rules.assignments)
+
+        self._nodes = dag_nodes(self.expression)
+        self._position = {node: index for index, node in enumerate(self._nodes)}
+        self._parents = {}
+        for node in self._nodes:
+            if isinstance(node, Function):
+                for arg in set(node.args):
+                    self._parents.setdefault(arg, []).append(node)
+        self._dependents = {} # Variable name -> the nodes containing it, in postorder
+        self._assigned = {}   # Node of the expression -> the node with the assignments applied
+        for node in self._nodes:
+            self._assigned[node] = self._assign(node)
+
+        self._normal_forms = {}
+        self._version = self.rules.version
+        self._compact_size = 0
+        self.result, self.initial_trace = self._normalize()
+
+    def _assign(self, node: Term) -> Term:
+        if isinstance(node, Variable):
+            return self.assignments.get(node.name, node)
+        if isinstance(node, Function):
+            return Function(node.name, [self._assigned[arg] for arg in node.args])
+        return node
 
-    return current_ast, ast_trace
+    def dependents(self, name: str) -> list:
+        """Returns the nodes of the expression that contain the variable name, in postorder."""
+        found = self._dependents.get(name)
+        if found is None:
+            found = []
+            variable = Variable(name)
+            if variable in self._position:
+                seen = {variable}
+                pending = [variable]
+                while pending:
+                    for parent in self._parents.get(pending.pop(), ()):
+                        if parent not in seen:
+                            seen.add(parent)
+                            pending.append(parent)
+                found = sorted(seen, key=self._position.__getitem__)
+            self._dependents[name] = found
+        return found
+
+    def update(self, assignments: dict = None, **values) -> tuple[Term, list]:
+        """
+        Changes the values of variables and returns the new normal form and the trace of
+        the rewrites this took. A value is a Term, a bool or int constant, an expression
+        string, or None to leave the variable unassigned.
+        """
+        changed = []
+        for name, value in {**(assignments or {}), **values}.items():
+            if value is None:
+                new = None
+            elif isinstance(value, Term):
+                new = value
+            elif isinstance(value, (bool, int)):
+                new = Constant(value)
+            elif isinstance(value, str):
+                new = parse_expression(value)
+            else:
+                raise TypeError(f"Cannot assign a {type(value).__name__} to {name}")
+            if self.assignments.get(name) is not new:
+                if new is None:
+                    del self.assignments[name]
+                else:
+                    self.assignments[name] = new
+                changed.append(name)
+
+        affected = [node for name in changed for node in self.dependents(name)]
+        if len(changed) > 1:
+            affected = sorted(set(affected), key=self._position.__getitem__)
+        for node in affected:
+            self._assigned[node] = self._assign(node)
+        self.result, trace = self._normalize()
+        return self.result, trace
+
+    def _normalize(self) -> tuple[Term, list]:
+        if self.rules.version != self._version:
+            # Rules were added or reordered, so the normal forms may no longer hold
+            self._normal_forms.clear()
+            self._version = self.rules.version
+        if len(self._normal_forms) > self.compact_factor * max(self._compact_size, len(self._nodes)):
+            normal_forms = self._normal_forms
+            self._normal_forms = {node: normal_forms[node] for node in self._assigned.values()
+                                  if node in normal_forms}
+            self._compact_size = len(self._normal_forms)
+        recorder = None if self.trace == 'off' else TraceRecorder(self.trace)
+        rewrite = _rewriter_for(self.rules, self.backend, None)
+        root = self._assigned[self.expression]
+        result = _normalizer_for(self.rules, self.strategy)(root, rewrite, recorder, self._normal_forms)
+        return result, [] if recorder is None else recorder.result()
 
 # --- Infix Expression Parsing with Shunting Yard Algorithm ---
 def parse_infix_expression(expression: str) -> Term:
@@ -380,10 +2116,23 @@ def handle_operator_popping(operator_stack: list, output_queue: list):
         # Create function node for this operation
         output_queue.append(Function(op_to_func[op], [left, right]))
 
+# For ASCII input, str.isdigit, str.isalpha and str.isalnum agree with these classes.
+_INFIX_TOKEN_PATTERN = re.compile(r'[0-9]+|[A-Za-z][A-Za-z0-9_]*|[-+*/^()]|\S')
+
 def tokenize_infix(expression: str) -> list:
     """
     Tokenizes an infix expression, handling numbers, operators, and parentheses.
     """
+    if not expression.isascii():
+        return _tokenize_infix_chars(expression)
+    tokens = _INFIX_TOKEN_PATTERN.findall(expression)
+    for token in tokens:
+        if len(token) == 1 and token not in '+-*/^()' and not token.isalnum():
+            raise ValueError(f"Unknown character in expression: '{token}'")
+    return tokens
+
+def _tokenize_infix_chars(expression: str) -> list:
+    """The character-by-character tokenizer, for expressions with non-ASCII characters."""
     tokens = []
     i = 0
     
@@ -429,6 +2178,11 @@ def tokenize_infix(expression: str) -> list:
     return tokens
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        # Command-line evaluation of expression files; see cli.py
+        from cli import main
+        sys.exit(main())
+
     rules, arity = parse_rules(sample_rules)
     # print rules and their arities
     print("Rules and their arities:")
@@ -0,0 +1,122 @@
+"""
+Precompiled on-disk rule sets.
+
+Parsing a large rules-and-assignments text is the slowest part of starting up. A compiled
+rule file stores a parsed RuleSet instead: the distinct nodes of every rule's pre-parsed
+sides with their symbol table (see flatterm.encode_dag), the rule order and the strat
+annotations, serialized with marshal. The file layout is
+
+    magic (8 bytes) | format version (uint16) | payload length (uint32)
+    | SHA-256 of the source text (32 bytes) | SHA-256 of the payload (32 bytes) | payload
+
+so a truncated or corrupted file, a file from another format version, or a file compiled
+from different source text is detected on load. load_rules() reads a rules text file and
+uses its compiled file when that is current, re-parsing (and rewriting it) otherwise:
+
+    rules = load_rules("rules.txt")   # writes rules.txt.rwc the first time
+"""
+import hashlib
+import marshal
+import os
+import struct
+
+from main import RuleSet
+from flatterm import encode_dag, decode_dag
+
+MAGIC = b'RWRULES\0'
+FORMAT_VERSION = 2
+_HEADER = struct.Struct('<8sHI32s32s')
+
+class RuleFileError(ValueError):
+    """A compiled rule file that cannot be used: malformed, corrupted, or stale."""
+
+def source_digest(source: str) -> bytes:
+    return hashlib.sha256(source.encode('utf-8')).digest()
+
+def dumps_rules(rules: RuleSet, source: str) -> bytes:
+    """Serializes rules, compiled from the text source, to the compiled rule file format."""
+    state = rules.__getstate__()
+    assignments = list(state['assignments'].items())
+    sides = [side for rule in state['rules'] for side in rule[3:]] + [term for _, term in assignments]
+    symbols, nodes, roots = encode_dag(sides)
+    payload = marshal.dumps((
+        state['names'],
+        [rule[:3] for rule in state['rules']],
+        state['arities'],
+        [name for name, _ in assignments],
+        state['order'],
+        state['strategies'],
+        symbols.kinds,
+        symbols.payloads,
+        nodes,
+        roots,
+    ))
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, len(payload), source_digest(source),
+                          hashlib.sha256(payload).digest())
+    return header + payload
+
+def loads_rules(data: bytes, source: str = None) -> RuleSet:
+    """
+    Rebuilds a RuleSet from dumps_rules() output. With source, also checks that the data
+    was compiled from that text. Raises RuleFileError if the data cannot be used.
+    """
+    if len(data) < _HEADER.size:
+        raise RuleFileError("Compiled rule file is truncated")
+    magic, version, length, digest, checksum = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise RuleFileError("Not a compiled rule file")
+    if version != FORMAT_VERSION:
+        raise RuleFileError(f"Unsupported compiled rule file version {version}")
+    payload = data[_HEADER.size:]
+    if len(payload) != length or hashlib.sha256(payload).digest() != checksum:
+        raise RuleFileError("Compiled rule file is corrupted")
+    if source is not None and digest != source_digest(source):
+        raise RuleFileError("Compiled rule file is out of date with its source")
+
+    names, rules, arities, assigned, order, strategies, kinds, payloads, nodes, roots = marshal.loads(payload)
+    terms = decode_dag(kinds, payloads, nodes)
+    sides = [terms[root] for root in roots]
+    rule_set = RuleSet.__new__(RuleSet)
+    rule_set.__setstate__({
+        'names': names,
+        'rules': [(name, lhs_str, rhs_str, sides[2 * i], sides[2 * i + 1])
+                  for i, (name, lhs_str, rhs_str) in enumerate(rules)],
+        'arities': arities,
+        'assignments': dict(zip(assigned, sides[2 * len(rules):])),
+        'order': order,
+        'strategies': strategies,
+    })
+    return rule_set
+
+def save_compiled(rules: RuleSet, source: str, path: str) -> None:
+    """Writes a compiled rule file, replacing any old one atomically."""
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'wb') as stream:
+        stream.write(dumps_rules(rules, source))
+    os.replace(temporary, path)
+
+def load_compiled(path: str, source: str = None) -> RuleSet:
+    with open(path, 'rb') as stream:
+        return loads_rules(stream.read(), source)
+
+def load_rules(source_path: str, compiled_path: str = None, write: bool = True) -> RuleSet:
+    """
+    Loads the rules-and-assignments file at source_path, from its compiled file
+    (default: source_path + '.rwc') if that was compiled from the current text. Otherwise
+    the text is parsed and, with write, the compiled file is (re)written; failing to
+    write it is not an error.
+    """
+    compiled_path = compiled_path or source_path + '.rwc'
+    with open(source_path, encoding='utf-8') as stream:
+        source = stream.read()
+    try:
+        return load_compiled(compiled_path, source)
+    except (OSError, RuleFileError):
+        pass
+    rules = RuleSet.from_string(source)
+    if write:
+        try:
+            save_compiled(rules, source, compiled_path)
+        except OSError:
+            pass
+    return rules
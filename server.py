@@ -0,0 +1,301 @@
+"""
+A local evaluation server that keeps named rule sets parsed and ready.
+
+    python server.py --rules bool=rules.txt --rules peano=peano.txt --socket /tmp/rewrite.sock
+    python server.py --rules bool=rules.txt --port 7878 --workers 4
+
+Clients connect over a Unix socket or localhost TCP and send JSON lines. Requests may be
+pipelined; each response carries the request's "id" and is written as soon as it is
+ready, so responses can come back in a different order than the requests.
+
+    {"id": 1, "rules": "bool", "expression": "And(x, Not(false))"}
+    {"id": 1, "result": "true"}
+
+An evaluate request may also set "trace" (true for the list of steps), "infix" (parse
+the expression with parse_infix_expression), "strategy", "backend", "max_steps",
+"timeout", "max_size" and "detect_cycles", with the same meaning as for evaluate().
+A failed evaluation answers {"id": ..., "error": message, "error_type": name}, plus
+"partial" (the partially rewritten term) when a limit stopped it. Other operations are
+{"op": "load", "name": ..., "text": rules} to add or replace a rule set, {"op": "stats"}
+for the request counters and latencies, and {"op": "ping"}.
+
+Normalization runs in a pool of worker processes (or threads, with --workers 0) so the
+event loop stays responsive, and identical requests that are in flight at the same time
+are evaluated once.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from main import RuleSet, EvaluationLimitError, compile_rules, evaluate, format_term, parse_infix_expression
+from rulefile import load_rules
+
+# Request fields passed on to evaluate(), with the types they must have.
+EVALUATE_OPTIONS = {
+    'strategy': str,
+    'backend': str,
+    'max_steps': int,
+    'timeout': (int, float),
+    'max_size': int,
+    'detect_cycles': bool,
+}
+
+# The rule sets of a worker process, set by _init_worker when the pool starts.
+_worker_rule_sets = None
+
+def _init_worker(rule_sets: dict) -> None:
+    global _worker_rule_sets
+    _worker_rule_sets = rule_sets
+
+def _evaluate_in_worker(name: str, expression: str, infix: bool, trace: bool, options: dict) -> dict:
+    return evaluate_request(_worker_rule_sets[name], expression, infix, trace, options)
+
+def evaluate_request(rules: RuleSet, expression: str, infix: bool = False, trace: bool = False,
+                     options: dict = None) -> dict:
+    """Evaluates one request and returns the response fields (without the id)."""
+    try:
+        term = parse_infix_expression(expression) if infix else expression
+        result, steps = evaluate(term, rules, trace='full' if trace else 'off', **(options or {}))
+    except EvaluationLimitError as error:
+        return {'error': str(error), 'error_type': type(error).__name__, 'partial': format_term(error.term)}
+    except (ValueError, TypeError) as error:
+        return {'error': str(error), 'error_type': type(error).__name__}
+    response = {'result': format_term(result)}
+    if trace:
+        response['trace'] = [{'before': format_term(before), 'rule': f"{lhs} -> {rhs}", 'after': format_term(after)}
+                             for before, lhs, rhs, after in steps]
+    return response
+
+class ServerStats:
+    """Request counters and the latencies of the most recent responses."""
+    def __init__(self, window: int = 10_000):
+        self.started = time.monotonic()
+        self.requests = 0
+        self.responses = 0
+        self.errors = 0
+        self.coalesced = 0
+        self.in_flight = 0
+        self.latencies = deque(maxlen=window)
+
+    def snapshot(self) -> dict:
+        uptime = time.monotonic() - self.started
+        latencies = sorted(self.latencies)
+
+        def percentile(fraction):
+            return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000 if latencies else 0.0
+
+        return {
+            'uptime_seconds': uptime,
+            'requests': self.requests,
+            'responses': self.responses,
+            'errors': self.errors,
+            'coalesced': self.coalesced,
+            'in_flight': self.in_flight,
+            'responses_per_second': self.responses / uptime if uptime else 0.0,
+            'latency_ms': {
+                'mean': sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+                'p50': percentile(0.50),
+                'p99': percentile(0.99),
+                'max': latencies[-1] * 1000 if latencies else 0.0,
+            },
+        }
+
+class EvaluationServer:
+    """
+    Serves evaluate requests against named rule sets. workers is the number of worker
+    processes; with 0, normalization runs in a thread of this process instead. At most
+    max_in_flight requests per connection are evaluated at once; reading more of that
+    connection's input waits until one finishes.
+    """
+    def __init__(self, rule_sets: dict = None, workers: int = 0, max_in_flight: int = 256):
+        self.workers = workers
+        self.max_in_flight = max_in_flight
+        self.rule_sets = {}
+        self.generations = {} # name -> number of times it was (re)loaded, part of the coalescing key
+        self.stats = ServerStats()
+        self._in_flight = {}  # coalescing key -> asyncio.Future of the response fields
+        self._executor = None
+        self._server = None
+        for name, rules in (rule_sets or {}).items():
+            self.add_rules(name, rules)
+
+    def add_rules(self, name: str, rules) -> None:
+        """Adds or replaces a rule set (a RuleSet or rules-and-assignments text)."""
+        self.rule_sets[name] = compile_rules(rules)
+        self.generations[name] = self.generations.get(name, 0) + 1
+        if self._executor is not None and self.workers > 0:
+            # Worker processes receive the rule sets when they start, so start new ones.
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.workers > 0:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                                     initargs=(self.rule_sets,))
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=1)
+        return self._executor
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0, path: str = None):
+        """Starts listening on a Unix socket at path, or on host and port. Returns the asyncio server."""
+        if path is not None:
+            self._server = await asyncio.start_unix_server(self.handle_connection, path=path)
+        else:
+            self._server = await asyncio.start_server(self.handle_connection, host, port)
+        return self._server
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        slots = asyncio.Semaphore(self.max_in_flight)
+        tasks = set()
+
+        async def respond(line: bytes):
+            try:
+                response = await self.handle_line(line)
+                writer.write(json.dumps(response).encode('utf-8') + b"\n")
+                await writer.drain()
+            except ConnectionError:
+                pass
+            finally:
+                slots.release()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                await slots.acquire()
+                task = asyncio.create_task(respond(line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            writer.close()
+
+    async def handle_line(self, line: bytes) -> dict:
+        """Handles one request line and returns its response."""
+        start = time.monotonic()
+        self.stats.requests += 1
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("A request must be a JSON object")
+            request_id = request.get('id')
+            response = await self.handle_request(request)
+        except Exception as error: # Reported to the client; the connection stays usable
+            response = {'error': str(error), 'error_type': type(error).__name__}
+        if 'error' in response:
+            self.stats.errors += 1
+        self.stats.responses += 1
+        self.stats.latencies.append(time.monotonic() - start)
+        return {'id': request_id, **response}
+
+    async def handle_request(self, request: dict) -> dict:
+        op = request.get('op', 'evaluate')
+        if op == 'evaluate':
+            return await self.evaluate(request)
+        if op == 'load':
+            self.add_rules(request['name'], request['text'])
+            return {'loaded': request['name'], 'rules': len(self.rule_sets[request['name']])}
+        if op == 'stats':
+            return {'stats': self.stats.snapshot()}
+        if op == 'ping':
+            return {'pong': True}
+        raise ValueError(f"Unknown op: {op}")
+
+    async def evaluate(self, request: dict) -> dict:
+        name = request.get('rules')
+        if name not in self.rule_sets:
+            raise ValueError(f"Unknown rule set: {name}")
+        expression = request['expression']
+        if not isinstance(expression, str):
+            raise TypeError("expression must be a string")
+        options = {}
+        for option, option_type in EVALUATE_OPTIONS.items():
+            if request.get(option) is not None:
+                if not isinstance(request[option], option_type):
+                    raise TypeError(f"Invalid value for {option}: {request[option]!r}")
+                options[option] = request[option]
+        infix = bool(request.get('infix', False))
+        trace = bool(request.get('trace', False))
+
+        key = (name, self.generations[name], expression, infix, trace, tuple(sorted(options.items())))
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.stats.coalesced += 1
+            return await asyncio.shield(future)
+
+        loop = asyncio.get_running_loop()
+        future = self._in_flight[key] = loop.create_future()
+        self.stats.in_flight += 1
+        try:
+            if self.workers > 0:
+                call = (_evaluate_in_worker, name, expression, infix, trace, options)
+            else:
+                call = (evaluate_request, self.rule_sets[name], expression, infix, trace, options)
+            response = await loop.run_in_executor(self._get_executor(), *call)
+            future.set_result(response)
+            return response
+        except BaseException as error:
+            future.set_exception(error)
+            future.exception() # Retrieved here, so waiters alone need not see it
+            raise
+        finally:
+            self.stats.in_flight -= 1
+            del self._in_flight[key]
+
+def _parse_rule_arguments(values: list) -> dict:
+    rule_sets = {}
+    for value in values:
+        name, separator, path = value.partition('=')
+        if not separator:
+            raise SystemExit(f"--rules expects NAME=PATH, got {value!r}")
+        rule_sets[name] = load_rules(path)
+    return rule_sets
+
+async def serve(server: EvaluationServer, host: str, port: int, path: str) -> None:
+    listener = await server.start(host, port, path)
+    where = path or ", ".join(str(sock.getsockname()) for sock in listener.sockets)
+    print(f"Serving {', '.join(server.rule_sets) or 'no rule sets'} on {where}", file=sys.stderr)
+    try:
+        await listener.serve_forever()
+    finally:
+        await server.close()
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rules', action='append', default=[], metavar='NAME=PATH',
+                        help='a named rules file to keep loaded (repeatable)')
+    parser.add_argument('--socket', help='listen on this Unix socket path')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7878)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='worker processes (0: evaluate in a thread of the server process)')
+    args = parser.parse_args(argv)
+
+    server = EvaluationServer(_parse_rule_arguments(args.rules), workers=args.workers)
+    try:
+        asyncio.run(serve(server, args.host, args.port, args.socket))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,370 @@
+"""
+Compact binary serialization of terms, and a memory-mapped store of many terms.
+
+dumps() writes a term as a symbol table followed by its nodes in preorder, each as one
+varint: the symbol id of a new node, or a back-reference to a subterm written earlier.
+Only subterms with more than one parent get a back-reference slot, so a tree costs one
+or two bytes per node and a term with heavy sharing is stored in time and space
+proportional to its distinct nodes. Encoding and decoding are iterative, so terms of
+any depth round-trip without touching the recursion limit (unlike pickling nested
+objects).
+
+    data = dumps(term)
+    assert loads(data) is term           # Terms are interned
+
+TermStore reads a file written by TermStoreWriter through mmap, decoding a term only
+when it is accessed, so a store larger than memory can be used:
+
+    with TermStoreWriter("terms.rwts") as writer:
+        for term in terms:
+            writer.append(term)
+    store = TermStore("terms.rwts")
+    store[123_456]
+"""
+import mmap
+import struct
+
+from main import Term, Function, Constant, Variable
+
+MAGIC = b'RWT'
+FORMAT_VERSION = 1
+
+# Symbol kinds in the symbol table
+_FUNCTION = 0
+_VARIABLE = 1
+_TRUE = 2
+_FALSE = 3
+_INT = 4
+_STR = 5
+_FLOAT = 6
+
+# The low two bits of each node varint
+_NODE = 0      # A node, symbol id in the remaining bits
+_SHARED = 1    # A node that is referred back to later; it takes the next reference slot
+_BACKREF = 2   # A reference to an earlier shared node, slot number in the remaining bits
+_UNUSED_TAG = 3  # Never written, so rejected when reading
+
+_DOUBLE = struct.Struct('<d')
+
+class TermFormatError(ValueError):
+    """Data that is not a valid encoded term."""
+
+def _write_varint(out: bytearray, value: int) -> None:
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def _write_text(out: bytearray, text: str) -> None:
+    encoded = text.encode('utf-8')
+    _write_varint(out, len(encoded))
+    out += encoded
+
+def _read_varint(data, position: int):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+def _shared_nodes(terms: list) -> set:
+    """Returns the function nodes that are reached more than once from terms."""
+    seen = set()
+    shared = set()
+    pending = list(terms)
+    while pending:
+        node = pending.pop()
+        if node.__class__ is not Function or not node.args:
+            continue
+        if node in seen:
+            shared.add(node)
+            continue
+        seen.add(node)
+        pending.extend(node.args)
+    return shared
+
+def dumps_many(terms: list) -> bytes:
+    """Encodes a list of terms together, so subterms they share are stored once."""
+    symbols = {}        # symbol key -> id
+    symbol_table = bytearray()
+    body = bytearray()
+    shared = _shared_nodes(terms)
+    slots = {}          # shared node -> reference slot
+
+    def symbol_id(node) -> int:
+        cls = node.__class__
+        if cls is Function:
+            key = (_FUNCTION, node.name, len(node.args))
+        elif cls is Variable:
+            key = (_VARIABLE, node.name)
+        elif cls is Constant:
+            key = (Constant, type(node.value), node.value)
+        else:
+            raise TypeError(f"Cannot encode {type(node).__name__}")
+        found = symbols.get(key)
+        if found is not None:
+            return found
+        found = symbols[key] = len(symbols)
+        if cls is Function:
+            symbol_table.append(_FUNCTION)
+            _write_varint(symbol_table, len(node.args))
+            _write_text(symbol_table, node.name)
+        elif cls is Variable:
+            symbol_table.append(_VARIABLE)
+            _write_text(symbol_table, node.name)
+        else:
+            value = node.value
+            if value is True or value is False:
+                symbol_table.append(_TRUE if value else _FALSE)
+            elif type(value) is int:
+                symbol_table.append(_INT)
+                _write_varint(symbol_table, (value << 1) ^ -1 if value < 0 else value << 1) # Zigzag
+            elif type(value) is str:
+                symbol_table.append(_STR)
+                _write_text(symbol_table, value)
+            elif type(value) is float:
+                symbol_table.append(_FLOAT)
+                symbol_table.extend(_DOUBLE.pack(value))
+            else:
+                raise TypeError(f"Cannot encode a constant of type {type(value).__name__}")
+        return found
+
+    # Function name and arity -> symbol id, to skip symbol_id() for the common case
+    function_ids = {}
+    for term in terms:
+        pending = [term]
+        while pending:
+            node = pending.pop()
+            slot = slots.get(node)
+            if slot is not None:
+                _write_varint(body, slot << 2 | _BACKREF)
+                continue
+            if node.__class__ is Function:
+                args = node.args
+                key = (node.name, len(args))
+                symbol = function_ids.get(key)
+                if symbol is None:
+                    symbol = function_ids[key] = symbol_id(node)
+                if node in shared:
+                    slots[node] = len(slots)
+                    _write_varint(body, symbol << 2 | _SHARED)
+                else:
+                    _write_varint(body, symbol << 2)
+                if args:
+                    pending.extend(reversed(args))
+            else:
+                _write_varint(body, symbol_id(node) << 2)
+
+    out = bytearray(MAGIC)
+    out.append(FORMAT_VERSION)
+    _write_varint(out, len(symbols))
+    out += symbol_table
+    _write_varint(out, len(terms))
+    out += body
+    return bytes(out)
+
+def dumps(term: Term) -> bytes:
+    """Encodes term in the compact binary format."""
+    return dumps_many([term])
+
+def _read_symbols(data, position: int):
+    """Returns (symbols, position): per symbol id, a leaf Term, or (name, arity) for a function."""
+    count, position = _read_varint(data, position)
+    symbols = []
+    for _ in range(count):
+        kind = data[position]
+        position += 1
+        if kind == _FUNCTION:
+            arity, position = _read_varint(data, position)
+            length, position = _read_varint(data, position)
+            name = bytes(data[position:position + length]).decode('utf-8')
+            position += length
+            symbols.append(Function(name, ()) if arity == 0 else (name, arity))
+        elif kind == _VARIABLE or kind == _STR:
+            length, position = _read_varint(data, position)
+            text = bytes(data[position:position + length]).decode('utf-8')
+            position += length
+            symbols.append(Variable(text) if kind == _VARIABLE else Constant(text))
+        elif kind == _TRUE or kind == _FALSE:
+            symbols.append(Constant(kind == _TRUE))
+        elif kind == _INT:
+            value, position = _read_varint(data, position)
+            symbols.append(Constant(value >> 1 if not value & 1 else ~(value >> 1)))
+        elif kind == _FLOAT:
+            symbols.append(Constant(_DOUBLE.unpack_from(data, position)[0]))
+            position += _DOUBLE.size
+        else:
+            raise TermFormatError(f"Unknown symbol kind {kind}")
+    return symbols, position
+
+def loads_many(data) -> list:
+    """Decodes the terms written by dumps_many (from bytes or any buffer)."""
+    try:
+        if bytes(data[:len(MAGIC)]) != MAGIC:
+            raise TermFormatError("Not an encoded term")
+        if data[len(MAGIC)] != FORMAT_VERSION:
+            raise TermFormatError(f"Unsupported term format version {data[len(MAGIC)]}")
+        symbols, position = _read_symbols(data, len(MAGIC) + 1)
+        count, position = _read_varint(data, position)
+        terms = []
+        slots = []
+        stack = [] # [name, arity, args so far, slot or None] for each unfinished function
+        while len(terms) < count:
+            # Read one varint inline; this loop runs once per node.
+            value = data[position]
+            position += 1
+            if value >= 0x80:
+                value &= 0x7f
+                shift = 7
+                while True:
+                    byte = data[position]
+                    position += 1
+                    value |= (byte & 0x7f) << shift
+                    if byte < 0x80:
+                        break
+                    shift += 7
+            tag = value & 3
+            if tag == _UNUSED_TAG:
+                raise TermFormatError(f"Malformed term data: unknown node tag {tag}")
+            if tag == _BACKREF:
+                term = slots[value >> 2]
+                if term is None:
+                    raise TermFormatError("Malformed term data: reference to an unfinished term")
+            else:
+                symbol = symbols[value >> 2]
+                if symbol.__class__ is tuple:
+                    slot = None
+                    if tag == _SHARED:
+                        slot = len(slots)
+                        slots.append(None)
+                    stack.append([symbol[0], symbol[1], [], slot])
+                    continue
+                term = symbol
+                if tag == _SHARED:
+                    slots.append(term)
+            # Hand the finished term to its parent, finishing every function it completes
+            while stack:
+                frame = stack[-1]
+                args = frame[2]
+                args.append(term)
+                if len(args) < frame[1]:
+                    break
+                stack.pop()
+                term = Function(frame[0], args)
+                if frame[3] is not None:
+                    slots[frame[3]] = term
+            else:
+                terms.append(term)
+    except (IndexError, TypeError, UnicodeDecodeError, struct.error) as error:
+        raise TermFormatError(f"Malformed term data: {error}") from error
+    if stack:
+        raise TermFormatError("Malformed term data: unfinished term")
+    if position != len(data):
+        raise TermFormatError("Malformed term data: trailing bytes")
+    return terms
+
+def loads(data) -> Term:
+    """Decodes a term written by dumps."""
+    terms = loads_many(data)
+    if len(terms) != 1:
+        raise TermFormatError(f"Expected one term, found {len(terms)}")
+    return terms[0]
+
+# --- Term store ---
+# A store file is the header, the encoded terms one after another, the offset of each
+# term (uint64), and a footer with the number of terms and the offset of that index.
+_STORE_MAGIC = b'RWTSTORE'
+_STORE_HEADER = struct.Struct('<8sH')
+_STORE_FOOTER = struct.Struct('<QQ8s')
+_OFFSET = struct.Struct('<Q')
+
+class TermStoreWriter:
+    """Appends terms to a new store file; close() (or leaving the with block) writes its index."""
+    def __init__(self, path: str):
+        self._stream = open(path, 'wb')
+        self._stream.write(_STORE_HEADER.pack(_STORE_MAGIC, FORMAT_VERSION))
+        self._offsets = []
+
+    def append(self, term: Term) -> int:
+        """Writes term and returns its index in the store."""
+        self._offsets.append(self._stream.tell())
+        self._stream.write(dumps(term))
+        return len(self._offsets) - 1
+
+    def close(self) -> None:
+        if self._stream.closed:
+            return
+        index_offset = self._stream.tell()
+        self._stream.write(b"".join(_OFFSET.pack(offset) for offset in self._offsets))
+        self._stream.write(_STORE_FOOTER.pack(len(self._offsets), index_offset, _STORE_MAGIC))
+        self._stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class TermStore:
+    """
+    Read access to a store file through mmap. Only the footer is read on opening; each
+    term is decoded from the mapped file when it is accessed.
+    """
+    def __init__(self, path: str):
+        with open(path, 'rb') as stream:
+            self._map = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        size = len(self._map)
+        if size < _STORE_HEADER.size + _STORE_FOOTER.size:
+            self.close()
+            raise TermFormatError("Term store is truncated")
+        magic, version = _STORE_HEADER.unpack_from(self._map, 0)
+        count, index_offset, end_magic = _STORE_FOOTER.unpack_from(self._map, size - _STORE_FOOTER.size)
+        if magic != _STORE_MAGIC or end_magic != _STORE_MAGIC:
+            self.close()
+            raise TermFormatError("Not a complete term store")
+        if version != FORMAT_VERSION:
+            self.close()
+            raise TermFormatError(f"Unsupported term store version {version}")
+        if index_offset < _STORE_HEADER.size or index_offset + count * _OFFSET.size != size - _STORE_FOOTER.size:
+            self.close()
+            raise TermFormatError("Term store index does not match the file size")
+        self._count = count
+        self._index_offset = index_offset
+
+    def _bounds(self, index: int):
+        start = _OFFSET.unpack_from(self._map, self._index_offset + index * _OFFSET.size)[0]
+        if index + 1 < self._count:
+            end = _OFFSET.unpack_from(self._map, self._index_offset + (index + 1) * _OFFSET.size)[0]
+        else:
+            end = self._index_offset
+        if not _STORE_HEADER.size <= start <= end <= self._index_offset:
+            raise TermFormatError(f"Term store index entry {index} is corrupt")
+        return start, end
+
+    def __getitem__(self, index: int) -> Term:
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("term store index out of range")
+        start, end = self._bounds(index)
+        return loads(self._map[start:end])
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self[index]
+
+    def close(self) -> None:
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,48 @@
+import random
+from main import Constant, RuleSet, evaluate, sample_rules, parse_expression, normalize, substitute_variables
+from batch import evaluate_many, iter_evaluate, normalize_parallel
+from bench import random_boolean_expression
+
+expressions = ["Not(true)", "And(x, Not(y))", "Xor(Or(false, true), Not(Not(x)))", "Not(Not(z))"] * 5
+rules_and_assignments = sample_rules + """
+x = true
+y = false
+"""
+
+def test_evaluate_many_serial_matches_evaluate():
+    rules = RuleSet.from_string(rules_and_assignments)
+    expected = [evaluate(expression, rules)[0] for expression in expressions]
+    assert evaluate_many(expressions, rules, workers=1) == expected
+    counted = evaluate_many(expressions, rules, workers=1, trace="counts")
+    assert [result for result, _ in counted] == expected
+    assert counted[0][1] == evaluate(expressions[0], rules, trace="counts")[1]
+
+def test_evaluate_many_with_workers_keeps_input_order_and_traces():
+    rules = RuleSet.from_string(rules_and_assignments)
+    expected = [evaluate(expression, rules) for expression in expressions]
+    results = evaluate_many(expressions, rules_and_assignments, workers=2, chunksize=3, trace=True)
+    assert [result for result, _ in results] == [result for result, _ in expected]
+    assert [len(trace) for _, trace in results] == [len(trace) for _, trace in expected]
+    assert results[1][0] is Constant(True)
+
+def test_iter_evaluate_consumes_input_lazily():
+    consumed = []
+    def source():
+        for expression in expressions:
+            consumed.append(expression)
+            yield expression
+    results = iter_evaluate(source(), rules_and_assignments, workers=2, chunksize=2, max_pending=1)
+    assert next(results) is Constant(False)
+    assert len(consumed) < len(expressions)
+    results.close()
+
+def test_normalize_parallel_matches_normalize():
+    rules = RuleSet.from_string(rules_and_assignments)
+    rng = random.Random(3)
+    for _ in range(3):
+        term = parse_expression(random_boolean_expression(rng, 10, ("x", "y", "z", "true", "false")))
+        term = substitute_variables(term, rules.assignments)
+        expected = normalize(term, rules)
+        assert normalize_parallel(term, rules, workers=2, threshold=100) is expected
+        assert normalize_parallel(term, rules, workers=2, threshold=100, backend="compiled") is expected
+    assert normalize_parallel(parse_expression("Not(z)"), rules, workers=2) is parse_expression("Not(z)")
@@ -0,0 +1,17 @@
+from bench import run_suite, compare
+
+def test_run_suite_reports_each_metric():
+    suite = run_suite(["innermost", "passes"], repeat=1, quick=True, only=["peano"])
+    assert [row["strategy"] for row in suite["results"]] == ["innermost", "passes"]
+    innermost, passes = suite["results"]
+    assert innermost["steps"] == passes["steps"] > 0
+    assert innermost["passes"] == 1 and passes["passes"] > 1
+    assert innermost["peak_memory_bytes"] > 0 and innermost["steps_per_second"] > 0
+
+def test_compare_flags_slowdowns_over_threshold():
+    row = {"name": "w", "strategy": "innermost", "parse_seconds": 1.0, "rewrite_seconds": 1.0,
+           "peak_memory_bytes": 100}
+    slower = dict(row, rewrite_seconds=1.5)
+    rows = compare({"results": [row]}, {"results": [slower]}, threshold=0.1)
+    assert [(metric, regressed) for _, _, metric, _, _, _, regressed in rows] == [
+        ("parse_seconds", False), ("rewrite_seconds", True), ("peak_memory_bytes", False)]
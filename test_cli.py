@@ -0,0 +1,69 @@
+import io
+import json
+import pickle
+from main import parse_expression, format_term, sample_rules, RuleSet, Constant
+from cli import main, read_records, evaluate_records, RecordError
+
+def test_format_term_round_trips_through_the_parser():
+    for expression in ["And(Not(x), Or(true, false))", "Pair(F(), y)", "Not(" * 3000 + "x" + ")" * 3000]:
+        assert format_term(parse_expression(expression)) == expression
+
+def test_read_records_skips_blank_lines_and_reads_jsonl():
+    assert list(read_records(io.StringIO("Not(x)\n\nAnd(x, y)\n"))) == [(1, "Not(x)"), (3, "And(x, y)")]
+    jsonl = io.StringIO('{"id": "a", "expression": "Not(x)"}\n{"expression": "y"}\n')
+    assert list(read_records(jsonl, "jsonl")) == [("a", "Not(x)"), (2, "y")]
+
+def test_main_reports_unreadable_jsonl_records(tmp_path, capsys):
+    rules_file = tmp_path / "rules.txt"
+    rules_file.write_text(sample_rules)
+    expressions = tmp_path / "expressions.jsonl"
+    expressions.write_text('{"expression": "Not(true)"}\n{bad json\n{"id": 7}\n{"expression": "Not(false)"}\n[1]\n')
+    assert main([str(rules_file), str(expressions), "--format", "jsonl"]) == 1
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [record.get("result") for record in records] == ["false", None, None, "true", None]
+    assert records[1]["expression"] == "{bad json" and "line 2" in records[1]["error"]
+    assert records[2]["id"] == 3 and "expression" in records[2]["error"]
+
+def test_unreadable_records_are_written_without_waiting_for_more_input():
+    rules = RuleSet.from_string(sample_rules)
+    read = []
+    def lines():
+        for number in range(1000):
+            read.append(number)
+            yield "{bad json\n"
+        yield '{"expression": "Not(true)"}\n'
+    outcomes = evaluate_records(read_records(lines(), 'jsonl'), rules, workers=1)
+    record_id, line, error = next(outcomes)
+    assert (record_id, line, len(read)) == (1, "{bad json", 1)
+    assert isinstance(error, RecordError)
+    assert pickle.loads(pickle.dumps(error)).line == "{bad json"
+    assert list(outcomes)[-1][2] is Constant(False)
+
+def test_main_streams_normal_forms(tmp_path, capsys):
+    rules_file = tmp_path / "rules.txt"
+    rules_file.write_text(sample_rules + "\nx = true\n")
+    expressions = tmp_path / "expressions.txt"
+    expressions.write_text("Not(Not(x))\nAnd(x, y)\nBad(\n")
+    assert main([str(rules_file), str(expressions)]) == 1
+    assert capsys.readouterr().out.splitlines() == [
+        "true", "And(true, y)", "error: Expected ')' after arguments for 'Bad'"]
+
+    assert main([str(rules_file), str(expressions), "--output", "jsonl", "--trace"]) == 1
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert records[0]["result"] == "true" and len(records[0]["trace"]) == 2
+    assert records[2]["id"] == 3 and "error" in records[2]
+
+def test_main_reports_unwritable_results_per_record(tmp_path, capsys, monkeypatch):
+    import main as engine
+    rules_file = tmp_path / "rules.txt"
+    rules_file.write_text("")
+    expressions = tmp_path / "expressions.txt"
+    expressions.write_text("Pow(10, 5000)\nAdd(1, 2)\n")
+    # Too large for a builtin to compute: left as it is.
+    assert main([str(rules_file), str(expressions)]) == 0
+    assert capsys.readouterr().out.splitlines() == ["Pow(10, 5000)", "3"]
+
+    monkeypatch.setattr(engine, "MAX_INT_BITS", 10**6)
+    assert main([str(rules_file), str(expressions)]) == 1
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].startswith("error: ") and lines[1] == "3"
@@ -0,0 +1,45 @@
+from main import parse_expression, Variable, RuleSet, normalize, sample_rules
+from flatterm import FlatTerm, FlatRuleSet, SymbolTable, match_flat
+
+pair_rules = sample_rules + """
+Pair: 2
+Pair(x, x) -> Same(x, Not(x), true)
+Pair(Same(a, b, c), y) -> y
+"""
+
+def test_flat_term_round_trip():
+    term = parse_expression("And(Not(x), Or(true, Pair(x, false)))")
+    flat = FlatTerm.from_term(term)
+    assert len(flat) == term.size
+    assert flat.to_term() is term
+    assert flat.subterm(2).to_term() is term.args[0].args[0]
+    assert flat.subterm_end(1) == 3
+
+def test_match_flat_binds_subterms():
+    symbols = SymbolTable()
+    pattern = FlatTerm.from_term(parse_expression("Pair(x, Not(x))"), symbols)
+    target = FlatTerm.from_term(parse_expression("Pair(And(a, b), Not(And(a, b)))"), symbols)
+    bindings = match_flat(pattern, target)
+    assert bindings["x"].to_term() is parse_expression("And(a, b)")
+    other = FlatTerm.from_term(parse_expression("Pair(And(a, b), Not(And(b, a)))"), symbols)
+    assert match_flat(pattern, other) is None
+
+def test_flat_normalize_matches_term_normalize():
+    rules = RuleSet.from_string(pair_rules)
+    flat_rules = FlatRuleSet(rules)
+    for expression in ["Xor(Not(true), Or(false, And(true, Not(false))))",
+                       "Pair(Not(Not(x)), x)",
+                       "Pair(Pair(y, y), Not(And(z, true)))",
+                       "Not(Not(Not(Not(And(x, Not(Not(true)))))))"]:
+        term = parse_expression(expression)
+        trace, flat_trace = [], []
+        result = flat_rules.normalize(flat_rules.encode(term), flat_trace)
+        assert result.to_term() is normalize(term, rules, trace)
+        # The flat normalizer keeps no table of normal forms, so it may repeat steps
+        assert len(flat_trace) >= len(trace)
+
+def test_flat_normalize_deep_chain():
+    depth = 50_000
+    flat_rules = FlatRuleSet(RuleSet.from_string(sample_rules))
+    term = parse_expression("Not(" * depth + "y" + ")" * depth)
+    assert flat_rules.normalize(term).to_term() is Variable("y")
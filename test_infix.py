@@ -131,6 +131,19 @@ def test_integrated_infix_evaluation():
     assert ast.args[1].args[0].value == 3
     assert ast.args[1].args[1].value == 4
 
+def test_evaluate_infix_expression_with_builtins():
+    """Integer arithmetic is computed natively, one step per operator."""
+    result, trace = evaluate(parse_infix_expression("2 + 3*4"), "")
+    assert result is Constant(14)
+    assert [(before, after) for before, _, _, after in trace] == [
+        (Function("Mul", [Constant(3), Constant(4)]), Constant(12)),
+        (Function("Add", [Constant(2), Constant(12)]), Constant(14)),
+    ]
+    assert evaluate(parse_infix_expression("(2 + 3) * 4 - 2^3 / 3"), "", trace="off")[0] is Constant(18)
+    # Non-integer arguments and division by zero are left alone
+    assert evaluate(parse_infix_expression("x + 1*2"), "")[0] is Function("Add", [Variable("x"), Constant(2)])
+    assert evaluate("Div(7, 0)", "")[0] is parse_expression("Div(7, 0)")
+
 def ast_to_string(ast):
     """
     Convert an AST back to a string representation that can be parsed.
@@ -1,5 +1,10 @@
+import pickle
 import pytest
-from main import parse_expression, Function, Constant, Variable, evaluate
+from main import parse_expression, Function, Constant, Variable, evaluate, RuleSet, sample_rules, \
+    normalize, NormalFormCache, match_pattern, substitute_variables, apply_single_rule_pass, \
+    TraceRecorder, EvaluationStats, patterns_overlap, ParseCache, tokenize, tokenize_infix, BUILTINS, \
+    dag_size, dag_nodes, StepLimitExceeded, DeadlineExceeded, TermSizeExceeded, RewriteCycleError, \
+    EvaluationSession, format_term
 
 def test_parse_expression_not_true():
     expression = "Not(true)"
@@ -68,6 +73,467 @@ def test_evaluate_expression_not_not_true():
         print(f"  After: {after}")
     assert evaluated_ast == expected_result
 
+def test_rule_set_is_parsed_once_and_reused():
+    rules = RuleSet.from_string(sample_rules)
+    assert len(rules) == 15
+    assert rules.arities["Not"] == 1
+    not_rules = rules.rules_for("Not")
+    assert [rule.lhs_str for rule in not_rules] == ["Not(true)", "Not(false)", "Not(Not(x))"]
+    assert rules.rules_by_id[not_rules[2].rule_id] is not_rules[2]
+
+    for expression, expected in [("Not(Not(true))", True), ("Xor(true, Or(false, false))", True),
+                                 ("And(Not(false), false)", False)]:
+        evaluated_ast, trace = evaluate(expression, rules)
+        assert evaluated_ast == Constant(expected)
+        assert trace
+
+def test_rule_index_returns_only_plausible_candidates():
+    rules = RuleSet.from_string(sample_rules)
+    candidates = rules.candidates(parse_expression("And(true, false)"))
+    assert [rule.lhs_str for rule in candidates] == ["And(true, false)"]
+    candidates = rules.candidates(parse_expression("Not(Not(y))"))
+    assert [rule.lhs_str for rule in candidates] == ["Not(Not(x))"]
+    assert rules.candidates(parse_expression("And(y, true)")) == []
+
+    overlapping = RuleSet.from_string("""
+    F: 2
+    F(x, true) -> x
+    F(false, y) -> y
+    F(x, x) -> x
+    """)
+    candidates = overlapping.candidates(parse_expression("F(false, true)"))
+    assert [rule.rule_id for rule in candidates] == [0, 1, 2]
+
+def test_terms_are_interned_and_immutable():
+    term = parse_expression("And(Not(x), Or(true, x))")
+    assert parse_expression("And(Not(x), Or(true, x))") is term
+    assert term.args[1].args[1] is term.args[0].args[0]
+    assert Function("Not", [Variable("x")]) is term.args[0]
+    assert Constant(1) is not Constant(True)
+    assert term.size == 6
+    assert pickle.loads(pickle.dumps(term)) is term
+    with pytest.raises(AttributeError):
+        term.name = "Or"
+
+def test_interning_across_threads_and_freeing():
+    import threading
+    results = [None, None]
+    start = threading.Barrier(2)
+
+    def build(slot):
+        start.wait()
+        results[slot] = [Function("Interned", [Constant(i), Function("Inner", [Constant(i)])]) for i in range(2000)]
+
+    threads = [threading.Thread(target=build, args=(slot,)) for slot in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(first is second for first, second in zip(*results))
+
+    import main
+    kept = results[0][7]
+    before = len(main._functions)
+    results.clear()
+    assert len(main._functions) <= before - 2 * 1999
+    assert Function("Interned", [Constant(7), Function("Inner", [Constant(7)])]) is kept
+
+def test_evaluate_terminates_with_unassigned_variables():
+    evaluated_ast, trace = evaluate("And(Not(Not(x)), Or(y, z))", sample_rules)
+    assert evaluated_ast is parse_expression("And(x, Or(y, z))")
+    assert len(trace) == 1
+
+def test_strategies_reach_the_same_normal_form():
+    rules = RuleSet.from_string(sample_rules)
+    for expression in ["Xor(Not(true), Or(false, And(true, Not(false))))",
+                       "Not(Not(Not(Not(And(x, Not(Not(true)))))))"]:
+        results = {strategy: evaluate(expression, rules, strategy)[0]
+                   for strategy in ("innermost", "outermost", "passes")}
+        assert results["innermost"] is results["outermost"] is results["passes"]
+
+
+def test_outermost_rewrites_parents_before_arguments():
+    rules = RuleSet.from_string(sample_rules)
+    term = parse_expression("Not(Not(Not(Not(true))))")
+    innermost_trace, outermost_trace = [], []
+    assert normalize(term, rules, innermost_trace) is Constant(True)
+    assert normalize(term, rules, outermost_trace, strategy="outermost") is Constant(True)
+    assert [step[1] for step in innermost_trace] == ["Not(true)", "Not(false)"]
+    assert [step[1] for step in outermost_trace] == ["Not(Not(x))", "Not(Not(x))"]
+    with pytest.raises(ValueError):
+        normalize(term, rules, strategy="sideways")
+
+def test_innermost_skips_rebuilt_nodes_already_normalized():
+    rules = RuleSet.from_string(sample_rules + "\nPair: 2\n")
+    expression = "Pair(And(Not(true), Not(false)), And(Not(Not(false)), true))"
+    for strategy in ("innermost", "outermost"):
+        _, counts = evaluate(expression, rules, strategy, trace="counts")
+        assert all(count == 1 for count in counts.values())
+    rules.set_strategy("Pair", (1, 2, 0))
+    _, counts = evaluate(expression, rules, trace="counts")
+    assert all(count == 1 for count in counts.values())
+
+def test_normal_form_cache_is_reused_and_invalidated():
+    rules = RuleSet.from_string(sample_rules)
+    cache = NormalFormCache(maxsize=64)
+    result, trace = evaluate("Xor(Not(true), Or(true, false))", rules, cache=cache)
+    assert result is Constant(True) and len(trace) == 3
+    hits = cache.hits
+    result, trace = evaluate("Xor(Not(true), Or(true, false))", rules, cache=cache)
+    assert result is Constant(True) and trace == []
+    assert cache.hits > hits
+
+    rules.add_rule("Xor", "Xor(false, x)", "x")
+    assert cache.get(rules, "innermost", parse_expression("Not(true)")) is None
+    cache.invalidate(rules)
+    assert len(cache) == 0
+
+    small = NormalFormCache(maxsize=2)
+    for expression in ["Not(true)", "Not(false)", "Not(Not(true))"]:
+        evaluate(expression, rules, cache=small)
+    assert len(small) == 2
+
+def test_deep_terms_do_not_hit_the_recursion_limit():
+    depth = 50_000
+    rules = RuleSet.from_string(sample_rules)
+    term = parse_expression("Not(" * depth + "x" + ")" * depth)
+    assert term.size == depth + 1
+    assert match_pattern(term, term, {})
+    assert not match_pattern(term, term.args[0], {})
+    assert substitute_variables(term, {"x": Constant(True)}) is parse_expression("Not(" * depth + "true" + ")" * depth)
+    new_ast, changed = apply_single_rule_pass(term, rules, [])
+    assert changed and new_ast.size < term.size
+    assert normalize(term, rules) is Variable("x")
+    assert normalize(term, rules, strategy="outermost") is Variable("x")
+
+def test_long_rewrite_chains_at_one_position_take_linear_time():
+    import time
+    steps = 40_000
+    rules = RuleSet.from_string("F: 1\nF(S(x)) -> F(x)\n")
+    term = Function("F", (parse_expression("S(" * steps + "Z()" + ")" * steps),))
+    started = time.perf_counter()
+    result, counts = evaluate(term, rules, trace="counts")
+    assert result is parse_expression("F(Z())") and sum(counts.values()) == steps
+    assert time.perf_counter() - started < 5 # Quadratic bookkeeping took about 9 s
+
+    rules.set_strategy("F", (1, 0))
+    started = time.perf_counter()
+    assert evaluate(term, rules, trace="counts")[0] is result
+    assert time.perf_counter() - started < 5
+
+def test_compiled_backend_matches_interpreted_results_and_traces():
+    rules = RuleSet.from_string(sample_rules + """
+    Pair: 2
+    Pair(x, x) -> Same(x, Not(x), true)
+    Pair(Same(a, b, c), y) -> y
+    """)
+    expressions = ["Xor(Not(true), Or(false, And(true, Not(false))))",
+                   "Pair(Not(Not(x)), x)",
+                   "Pair(Pair(y, y), Not(And(z, true)))",
+                   "Not(Not(Not(Not(And(x, Not(Not(true)))))))"]
+    for expression in expressions:
+        for strategy in ("innermost", "outermost", "passes"):
+            interpreted = evaluate(expression, rules, strategy)
+            compiled = evaluate(expression, rules, strategy, backend="compiled")
+            assert compiled[0] is interpreted[0]
+            assert compiled[1] == interpreted[1]
+    assert "def " in rules.rewriter("compiled").source
+    with pytest.raises(ValueError):
+        rules.rewriter("jit")
+    # Rule text with a carriage return, which ends a line of generated source
+    rules = RuleSet.from_string("Not: 1\nNot(\rtrue) -> false\n")
+    assert evaluate("Not(true)", rules, backend="compiled")[0] is Constant(False)
+
+def test_trace_levels_ring_buffer_and_sink():
+    import io
+    rules = RuleSet.from_string(sample_rules)
+    expression = "And(Not(false), Or(false, Not(Not(true))))"
+    result, full = evaluate(expression, rules)
+    assert len(full) == 4 and full[0][1] == "Not(false)"
+
+    for strategy in ("innermost", "outermost", "passes"):
+        result, compact = evaluate(expression, rules, strategy, trace="compact")
+        assert result is Constant(True)
+        assert compact[0] == (rules.rules_for("Not")[1].rule_id, (0,))
+        assert all(isinstance(path, tuple) for _, path in compact)
+    _, compact = evaluate(expression, rules, trace="compact")
+    assert [path for _, path in compact] == [(0,), (1, 1, 0), (1,), ()]
+
+    _, counts = evaluate(expression, rules, trace="counts")
+    assert sum(counts.values()) == len(full)
+    assert evaluate(expression, rules, trace="off") == (result, [])
+
+    sink = io.StringIO()
+    _, last = evaluate(expression, rules, trace_limit=2, trace_sink=sink)
+    assert last == full[-2:]
+    assert len(sink.getvalue().splitlines()) == len(full)
+    sink = io.StringIO()
+    recorder = TraceRecorder("full", sink=sink)
+    evaluate(expression, rules, trace=recorder)
+    assert len(recorder.steps) == 0 and len(sink.getvalue().splitlines()) == len(full)
+
+    # A shared term 2**40 nodes long written out is cut off at sink_term_limit nodes.
+    shared = parse_expression("Not(Not(true))")
+    for _ in range(40):
+        shared = Function("Pair", (shared, shared))
+    sink = io.StringIO()
+    evaluate(shared, rules, trace_sink=sink)
+    assert all(len(line) < 20 * 10_000 for line in sink.getvalue().splitlines())
+    assert format_term(parse_expression("And(Not(x), y)"), 2) == "And(Not(...), ...)"
+
+    recorder = TraceRecorder("compact")
+    assert evaluate(expression, rules, trace=recorder) == (result, recorder)
+    with pytest.raises(ValueError):
+        TraceRecorder("verbose")
+
+def test_evaluation_stats_and_callbacks():
+    rules = RuleSet.from_string(sample_rules)
+    events = []
+    stats = EvaluationStats(on_match=lambda node, rule, bindings: events.append(("match", rule.rule_id)),
+                            on_rewrite=lambda before, rule, after: events.append(("rewrite", rule.rule_id)),
+                            on_pass=lambda number, nodes: events.append(("pass", number, nodes)))
+    result, trace = evaluate("Not(Not(Not(x)))", rules, stats=stats)
+    assert result is parse_expression("Not(x)")
+    not_not = rules.rules_for("Not")[2]
+    rows = {row["rule_id"]: row for row in stats.rule_rows()}
+    assert rows[not_not.rule_id]["matches"] == 1
+    assert rows[not_not.rule_id]["attempts"] == 1 # The index keeps it away from Not(x)
+    assert stats.symbol_rows()[0]["symbol"] == "Not"
+    assert events == [("match", not_not.rule_id), ("rewrite", not_not.rule_id), ("pass", 1, stats.pass_nodes[0])]
+    assert "Not(Not(x)) -> x" in stats.report()
+
+    stats = EvaluationStats()
+    evaluate("And(Not(true), Or(x, false))", rules, strategy="passes", stats=stats)
+    assert stats.pass_nodes == [6, 5]
+
+    stats = EvaluationStats()
+    evaluate("Not(Not(Not(x)))", rules, backend="compiled", stats=stats)
+    assert stats.symbols["Not"][1] == 1
+
+def test_adaptive_rule_reordering(tmp_path):
+    assert patterns_overlap(parse_expression("F(x, A())"), parse_expression("F(B(), y)"))
+    assert not patterns_overlap(parse_expression("F(A())"), parse_expression("F(B())"))
+    assert not patterns_overlap(parse_expression("F(x, x)"), parse_expression("F(A(), B())"))
+    assert not patterns_overlap(parse_expression("F(x, G(x))"), parse_expression("F(y, y)"))
+
+    rules_text = """
+    G: 1
+    G(A()) -> true
+    G(B()) -> false
+    G(x) -> x
+    G(C()) -> false
+    """
+    rules = RuleSet.from_string(rules_text)
+    rules.reorder_interval = 3
+    version = rules.version
+    for _ in range(3):
+        assert evaluate("G(B())", rules, trace="off", adaptive=True) == (Constant(False), [])
+    assert rules.hit_counts == {1: 3}
+    assert rules.version > version
+    assert [rule.lhs_str for rule in rules.rules_for("G")] == ["G(B())", "G(A())", "G(x)", "G(C())"]
+    # G(C()) can never be hit and the general G(x) cannot move ahead of the rules it overlaps.
+    assert not rules.reorder({2: 9, 3: 9})
+    assert evaluate("G(A())", rules, backend="compiled")[0] is Constant(True)
+    assert evaluate("G(C())", rules)[0] is parse_expression("C()")
+
+    path = tmp_path / "order.json"
+    rules.save_order(str(path))
+    fresh = RuleSet.from_string(rules_text)
+    fresh.load_order(str(path))
+    assert fresh.rule_order() == rules.rule_order()
+    with pytest.raises(ValueError):
+        fresh.apply_rule_order({"G": ["G(C()) -> false"]})
+
+    # An unchanged ranking is not reordered again; a rule added later joins the overlap graph.
+    version = rules.version
+    assert not rules.reorder({1: 5}) and rules.version == version
+    rules.add_rule("G", "G(D())", "true")
+    assert rules.reorder({4: 99})
+    assert [rule.lhs_str for rule in rules.rules_for("G")] == ["G(B())", "G(A())", "G(x)", "G(D())", "G(C())"]
+
+def test_tokenizers_and_parse_cache():
+    assert tokenize(" And(x,\tNot( true ))") == ["And", "(", "x", ",", "Not", "(", "true", ")", ")"]
+    assert tokenize("") == []
+    assert tokenize_infix("12*(ab_1 + 3)^2") == ["12", "*", "(", "ab_1", "+", "3", ")", "^", "2"]
+    assert tokenize_infix("2x") == ["2", "x"]
+    assert tokenize_infix("é1 + 2") == ["é1", "+", "2"]
+    with pytest.raises(ValueError, match="Unknown character"):
+        tokenize_infix("1 + $")
+
+    cache = ParseCache(maxsize=2)
+    term = parse_expression("And(x, true)", cache)
+    assert parse_expression("And(x, true)", cache) is term
+    assert (cache.hits, cache.misses) == (1, 1)
+    parse_expression("Not(x)", cache)
+    parse_expression("Not(y)", cache)
+    assert len(cache) == 2
+    assert parse_expression("And(x, true)", cache) is term
+    assert cache.misses == 4
+    rules = RuleSet.from_string(sample_rules)
+    assert evaluate("Not(Not(x))", rules, parse_cache=cache)[0] is Variable("x")
+    with pytest.raises(ValueError):
+        ParseCache(0)
+
+def test_builtins_run_after_rules_and_can_be_registered():
+    rules = RuleSet.from_string("""
+    Add: 2
+    Add(0, x) -> x
+    """)
+    assert "Max" not in BUILTINS
+    rules.register_builtin("Max", max)
+    rules.register_builtin("Neg", lambda value: -value, arity=1)
+    for backend in ["interpreted", "compiled"]:
+        result, trace = evaluate("Max(Add(0, 5), Neg(Add(1, 2)))", rules, backend=backend, trace="compact")
+        assert result is Constant(5)
+        assert [rule_id for rule_id, _ in trace] == [0, "builtin:Add", "builtin:Neg", "builtin:Max"]
+    stats = EvaluationStats()
+    evaluate("Add(1, Add(0, 2))", rules, stats=stats)
+    assert {row["rule_id"] for row in stats.rule_rows()} == {0, "builtin:Add"}
+    # Booleans are not integers
+    assert evaluate("Add(true, 1)", rules)[0] is parse_expression("Add(true, 1)")
+    # Results above MAX_INT_BITS are not computed, so a timeout still applies
+    assert evaluate("Pow(7, 30000000)", "", timeout=0.1)[0] is parse_expression("Pow(7, 30000000)")
+    assert evaluate("Mul(Pow(2, 9000), Pow(2, 9000))", "")[0].name == "Mul"
+    assert evaluate("Pow(-2, 100)", "")[0] is Constant(2 ** 100)
+
+def test_shared_subterms_are_rewritten_once():
+    rules = RuleSet.from_string("""
+    Dup: 1
+    Dup(x) -> Pair(x, x)
+
+    Not: 1
+    Not(Not(x)) -> x
+    """)
+    depth = 100
+    expression = "Dup(" * depth + "Not(Not(a))" + ")" * depth
+    for strategy in ["innermost", "outermost", "passes"]:
+        result, trace = evaluate(expression, rules, strategy=strategy, trace="counts")
+        assert result.size == 2 ** (depth + 1) - 1 # The written-out tree
+        assert dag_size(result) == depth + 1       # The distinct nodes actually built
+        assert trace == {0: depth, 1: 1}
+
+    shared = parse_expression("Not(Not(a))")
+    for _ in range(200):
+        shared = Function("And", [shared, shared])
+    assert [node.name for node in dag_nodes(shared)[:3]] == ["a", "Not", "Not"]
+    result, trace = evaluate(shared, rules, strategy="passes", trace="counts")
+    assert trace == {1: 1} and dag_size(result) == 201
+
+def test_evaluation_limits_carry_the_partial_result():
+    rules = RuleSet.from_string(sample_rules)
+    expression = "And(true, " + "Not(" * 5 + "true" + ")" * 5 + ")"
+    for strategy in ["innermost", "outermost", "passes"]:
+        with pytest.raises(StepLimitExceeded) as raised:
+            evaluate(expression, rules, strategy=strategy, max_steps=2)
+        partial, steps = raised.value.term, raised.value.trace
+        assert len(steps) == 2 and partial.name == "And"
+        assert evaluate(partial, rules)[0] is evaluate(expression, rules)[0]
+        assert evaluate(expression, rules, strategy=strategy, max_steps=6, detect_cycles=True)[0] is Constant(False)
+
+    cycle = RuleSet.from_string("""
+    A: 0
+    A() -> B()
+
+    B: 0
+    B() -> A()
+    """)
+    for strategy in ["innermost", "outermost", "passes"]:
+        with pytest.raises(RewriteCycleError) as raised:
+            evaluate("Pair(x, A())", cycle, strategy=strategy, detect_cycles=True, trace="counts")
+        assert raised.value.term.name == "Pair" and sum(raised.value.trace.values()) >= 1
+    for strategy in ["innermost", "outermost", "passes"]:
+        with pytest.raises(DeadlineExceeded) as raised:
+            evaluate("A()", cycle, strategy=strategy, timeout=0.05, trace="off")
+        assert raised.value.term.name in ("A", "B")
+
+    growing = RuleSet.from_string("""
+    F: 1
+    F(x) -> F(S(x))
+    """)
+    with pytest.raises(TermSizeExceeded) as raised:
+        evaluate("F(a)", growing, max_size=50, detect_cycles=True, trace="off")
+    assert raised.value.term.size <= 50 and raised.value.trace == []
+    with pytest.raises(DeadlineExceeded):
+        evaluate("F(a)", growing, timeout=0, trace="off")
+    error = pickle.loads(pickle.dumps(raised.value))
+    assert error.term is raised.value.term
+
+def test_evaluation_session_recomputes_changed_paths():
+    rules = RuleSet.from_string(sample_rules + "\nx = true\ny = false\n")
+    expression = "And(Or(x, y), And(Not(Not(z)), Or(Not(y), Xor(z, z))))"
+    session = EvaluationSession(expression, rules)
+    assert session.result is evaluate(expression, rules)[0]
+
+    result, trace = session.update(z=True)
+    expected, full_trace = evaluate(expression, sample_rules + "\nx = true\ny = false\nz = true\n")
+    assert result is expected and 0 < len(trace) < len(full_trace)
+    assert len(session.dependents("x")) == 3 and session.dependents("w") == []
+
+    result, trace = session.update({"x": "false", "z": None}, y=True)
+    assert result is evaluate(expression, sample_rules + "\nx = false\ny = true\n")[0]
+    # Back to values seen before: the normal forms are found again without rewriting.
+    assert session.update(x=True, y=False, z=True) == (evaluate(
+        expression, sample_rules + "\nx = true\ny = false\nz = true\n")[0], [])
+
+def test_strat_annotations_short_circuit():
+    rules = RuleSet.from_string("""
+    And: 2 strat(1 0 2 0)
+    And(false, x) -> false
+    And(true, x) -> x
+
+    Not: 1
+    Not(true) -> false
+    Not(false) -> true
+
+    Loop: 0
+    Loop() -> Loop()
+    """)
+    assert rules.strategies == {"And": (1, 0, 2, 0)} and rules.arities["And"] == 2
+    assert pickle.loads(pickle.dumps(rules)).strategies == rules.strategies
+    # The second argument is never evaluated, so the Loop() rule never runs.
+    result, trace = evaluate("And(Not(true), Loop())", rules, max_steps=10)
+    assert result is Constant(False) and len(trace) == 2
+    assert evaluate("And(Not(false), Not(true))", rules, trace="compact")[1] == [(3, (0,)), (1, ()), (2, ())]
+    assert evaluate("And(x, Not(true))", rules)[0] is parse_expression("And(x, false)")
+    with pytest.raises(StepLimitExceeded) as raised:
+        evaluate("Not(And(true, Loop()))", rules, max_steps=5)
+    assert raised.value.term is parse_expression("Not(Loop())")
+
+    for strategy in [(1, 2), (0, 3, 0)]:
+        with pytest.raises(ValueError):
+            rules.set_strategy("And", strategy)
+    # Nodes with fewer or more arguments than declared use the default strategy.
+    assert evaluate("And(Not(true))", rules)[0] is parse_expression("And(false)")
+    assert evaluate("And(false, Not(true), Not(false))", rules)[0] is parse_expression("And(false, false, true)")
+    undeclared = RuleSet({"And": [("And(false, x)", "false")], "Not": [("Not(true)", "false")]})
+    undeclared.set_strategy("And", (1, 0, 2, 0))
+    assert evaluate("And(Not(true), Loop())", undeclared)[0] is Constant(False)
+    assert evaluate("And(Not(true))", undeclared)[0] is parse_expression("And(false)")
+    assert evaluate("And(true, Not(true), Not(true))", undeclared)[0] is parse_expression("And(true, false, false)")
+
+    rules.set_strategy("And", None)
+    assert evaluate("And(true, Not(false))", rules)[0] is Constant(True)
+
+def test_strat_annotations_with_shared_nodes():
+    rules = RuleSet.from_string("""
+    And: 2 strat(1 0 2 0)
+    And(false, x) -> false
+
+    Not: 1
+    Not(true) -> false
+    Not(Not(x)) -> x
+    """)
+    # And(false, y) is reached again after Not(true) was rewritten; that is not a cycle.
+    result, trace = evaluate("Pair(And(Not(true), y), And(false, y))", rules, detect_cycles=True)
+    assert result is parse_expression("Pair(false, false)") and len(trace) == 2
+
+    # An annotation on one symbol leaves the traces of the others unchanged.
+    plain = RuleSet.from_string(sample_rules)
+    annotated = RuleSet.from_string(sample_rules + "\nDummy: 1 strat(1 0)\n")
+    expression = "Pair(Not(Not(And(x, true))), Xor(Not(Not(And(x, true))), Not(Not(And(x, true)))))"
+    for trace in ["full", "compact"]:
+        assert evaluate(expression, plain, trace=trace) == evaluate(expression, annotated, trace=trace)
+
 
 if __name__ == "__main__":
     pytest.main([__file__])
@@ -0,0 +1,40 @@
+import os
+import pytest
+from main import RuleSet, evaluate, sample_rules, parse_expression
+from rulefile import dumps_rules, loads_rules, load_rules, RuleFileError
+
+def test_compiled_rules_round_trip():
+    source = sample_rules.replace("Or: 2", "Or: 2 strat(1 0 2 0)") + "\nx = true\n"
+    rules = RuleSet.from_string(source)
+    rules.reorder({rules.rules_for("And")[3].rule_id: 5})
+    loaded = loads_rules(dumps_rules(rules, source), source)
+    assert loaded.rule_order() == rules.rule_order()
+    assert loaded.arities == rules.arities and loaded.assignments == rules.assignments
+    assert loaded.strategies == {"Or": (1, 0, 2, 0)}
+    for before, after in zip(rules.rules_by_id, loaded.rules_by_id):
+        assert (before.lhs, before.rhs) == (after.lhs, after.rhs) # Interned, so identical
+    assert evaluate("And(x, Not(false))", loaded)[0] is parse_expression("true")
+
+def test_compiled_rules_reject_bad_data():
+    source = sample_rules
+    data = dumps_rules(RuleSet.from_string(source), source)
+    with pytest.raises(RuleFileError, match="out of date"):
+        loads_rules(data, source + "\nx = true\n")
+    with pytest.raises(RuleFileError, match="corrupted"):
+        loads_rules(data[:-1] + bytes([data[-1] ^ 1]))
+    with pytest.raises(RuleFileError, match="truncated"):
+        loads_rules(data[:10])
+    with pytest.raises(RuleFileError, match="Not a compiled"):
+        loads_rules(b"x" * len(data))
+
+def test_load_rules_falls_back_to_parsing(tmp_path):
+    source_path = tmp_path / "rules.txt"
+    source_path.write_text(sample_rules)
+    compiled_path = str(source_path) + ".rwc"
+    rules = load_rules(str(source_path))
+    assert os.path.exists(compiled_path)
+    assert load_rules(str(source_path)).rule_order() == rules.rule_order()
+
+    source_path.write_text(sample_rules + "\nx = true\n")
+    assert evaluate("x", load_rules(str(source_path)))[0] is parse_expression("true")
+    assert loads_rules(open(compiled_path, "rb").read(), source_path.read_text()).assignments
@@ -0,0 +1,60 @@
+import asyncio
+import json
+from main import RuleSet, evaluate, format_term, sample_rules
+from server import EvaluationServer
+
+async def _exchange(server, requests, path=None):
+    if path is None:
+        listener = await server.start(port=0)
+        host, port = listener.sockets[0].getsockname()[:2]
+        reader, writer = await asyncio.open_connection(host, port)
+    else:
+        await server.start(path=path)
+        reader, writer = await asyncio.open_unix_connection(path)
+    # Pipelined: every request is written before any response is read.
+    writer.write("".join(json.dumps(request) + "\n" for request in requests).encode())
+    await writer.drain()
+    responses = [json.loads(await reader.readline()) for _ in requests]
+    writer.close()
+    await server.close()
+    return {response["id"]: response for response in responses}
+
+def test_server_answers_like_evaluate():
+    rules = RuleSet.from_string(sample_rules + "\nx = true\n")
+    expressions = ["And(x, Not(false))", "Or(y, Not(x))", "Xor(true, Not(y))", "Not(" * 500 + "x" + ")" * 500]
+    requests = [{"id": i, "rules": "bool", "expression": expression} for i, expression in enumerate(expressions)]
+    requests += [
+        {"id": "trace", "rules": "bool", "expression": "Not(Not(x))", "trace": True},
+        {"id": "infix", "rules": "bool", "expression": "2 + 3*4", "infix": True},
+        {"id": "limit", "rules": "bool", "expression": "Not(Not(Not(x)))", "max_steps": 1},
+        {"id": "unknown", "rules": "nope", "expression": "x"},
+        {"id": "bad", "rules": "bool", "expression": "And(x,"},
+        {"id": "load", "op": "load", "name": "peano", "text": "Add: 2\nAdd(Z(), y) -> y\n"},
+        {"id": "ping", "op": "ping"},
+    ]
+    responses = asyncio.run(_exchange(EvaluationServer({"bool": rules}), requests))
+    for i, expression in enumerate(expressions):
+        assert responses[i]["result"] == format_term(evaluate(expression, rules)[0])
+    assert responses["trace"]["result"] == "true" and len(responses["trace"]["trace"]) == 2
+    assert responses["infix"]["result"] == "14"
+    assert responses["limit"]["error_type"] == "StepLimitExceeded"
+    assert responses["limit"]["partial"] == "Not(Not(false))"
+    assert "Unknown rule set" in responses["unknown"]["error"]
+    assert "error" in responses["bad"]
+    assert responses["load"]["rules"] == 1 and responses["ping"]["pong"]
+
+def test_server_coalesces_identical_requests_and_counts(tmp_path):
+    server = EvaluationServer({"bool": sample_rules})
+    expression = "And(" + "Not(" * 2000 + "true" + ")" * 2000 + ", false)"
+    requests = [{"id": i, "rules": "bool", "expression": expression} for i in range(20)]
+    requests.append({"id": "stats", "op": "stats"})
+    responses = asyncio.run(_exchange(server, requests, path=str(tmp_path / "rewrite.sock")))
+    assert {responses[i]["result"] for i in range(20)} == {"false"}
+    assert server.stats.coalesced >= 1
+    stats = responses["stats"]["stats"]
+    assert stats["requests"] == 21 and stats["latency_ms"]["max"] >= stats["latency_ms"]["p50"]
+
+def test_server_with_worker_processes():
+    server = EvaluationServer({"bool": sample_rules}, workers=1)
+    responses = asyncio.run(_exchange(server, [{"id": 1, "rules": "bool", "expression": "Not(And(true, false))"}]))
+    assert responses[1]["result"] == "true"
@@ -0,0 +1,82 @@
+import pickle
+import pytest
+from main import Function, Constant, Variable, parse_expression, dag_size
+from termcodec import dumps, loads, dumps_many, loads_many, TermStore, TermStoreWriter, TermFormatError
+
+def test_round_trip_of_every_kind_of_leaf():
+    term = Function("M", (Constant(-5), Constant(2**70), Constant("é"), Constant(1.5), Constant(True),
+                          Constant(False), Constant(1), Variable("x"), Function("c")))
+    assert loads(dumps(term)) is term
+    assert loads(memoryview(dumps(term))) is term
+
+def test_shared_subterms_are_stored_once():
+    shared = parse_expression("And(Or(x, y), Not(z))")
+    term = shared
+    for _ in range(60):
+        term = Function("Pair", (term, term))  # 2**60 nodes as a tree, 64 distinct ones
+    assert dag_size(term) < 70
+    data = dumps(term)
+    assert len(data) < 400
+    assert loads(data) is term
+    assert loads_many(dumps_many([shared, term, shared])) == [shared, term, shared]
+
+def test_deep_terms_and_pickling():
+    term = Constant(0)
+    for _ in range(100_000):
+        term = Function("S", (term,))
+    assert loads(dumps(term)) is term
+    assert pickle.loads(pickle.dumps(term)) is term
+
+def test_pickling_terms_with_constants_termcodec_cannot_encode():
+    term = Function("Pair", (Constant((1, 2)), Constant(0)))
+    for _ in range(10_000): # Deeper than the recursion limit
+        term = Function("S", (term, Constant(0)))
+    assert pickle.loads(pickle.dumps(term)) is term
+
+def test_malformed_data_is_rejected():
+    data = dumps(parse_expression("And(x, Not(y))"))
+    with pytest.raises(TermFormatError):
+        loads(b"junk" + data)
+    with pytest.raises(TermFormatError):
+        loads(data[:-1])
+    with pytest.raises(TermFormatError):
+        loads(data + b"\x00")
+    with pytest.raises(TermFormatError):
+        loads(dumps(Constant(1.5))[:-3])
+    # P(S(0), S(0)) ends with the nodes S (shared), 0 and a back-reference to S; making
+    # the 0 a back-reference too refers to S before S is finished.
+    shared = Function("S", (Constant(0),))
+    data = dumps(Function("P", (shared, shared)))
+    assert data[-2:] == bytes([2 << 2, 0 << 2 | 2])
+    with pytest.raises(TermFormatError):
+        loads(data[:-2] + bytes([0 << 2 | 2, 0 << 2 | 2]))
+    with pytest.raises(TermFormatError):
+        loads(dumps(Variable("x"))[:-1] + bytes([0 << 2 | 3]))  # Node tag 3 is not defined
+
+def test_term_store(tmp_path):
+    path = str(tmp_path / "terms.rwts")
+    terms = [parse_expression(f"And(x{i}, Not(Or(y, true)))") for i in range(100)]
+    with TermStoreWriter(path) as writer:
+        for term in terms:
+            writer.append(term)
+    with TermStore(path) as store:
+        assert len(store) == 100
+        assert store[42] is terms[42] and store[-1] is terms[-1]
+        assert list(store) == terms
+        with pytest.raises(IndexError):
+            store[100]
+    data = open(path, "rb").read()
+    (tmp_path / "bad.rwts").write_bytes(data[:-4])
+    with pytest.raises(TermFormatError):
+        TermStore(str(tmp_path / "bad.rwts"))
+    # A footer whose count does not fit the file, and an index entry pointing past the terms
+    footer = len(data) - 24
+    (tmp_path / "bad.rwts").write_bytes(data[:footer] + (101).to_bytes(8, "little") + data[footer + 8:])
+    with pytest.raises(TermFormatError):
+        TermStore(str(tmp_path / "bad.rwts"))
+    entry = footer - 8
+    (tmp_path / "bad.rwts").write_bytes(data[:entry] + (2**40).to_bytes(8, "little") + data[entry + 8:])
+    with TermStore(str(tmp_path / "bad.rwts")) as store:
+        assert store[0] is terms[0]
+        with pytest.raises(TermFormatError):
+            store[99]
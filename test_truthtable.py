@@ -0,0 +1,39 @@
+import itertools
+import pytest
+from main import Constant, RuleSet, evaluate, sample_rules
+from truthtable import TruthTables, all_assignments
+
+expression = "Xor(Not(a), Or(And(b, c), Not(Not(a))))"
+variables = ["a", "b", "c"]
+
+def expected_rows():
+    rules = RuleSet.from_string(sample_rules)
+    rows = []
+    for values in itertools.product((False, True), repeat=len(variables)):
+        assignments = "\n".join(f"{name} = {str(value).lower()}" for name, value in zip(variables, values))
+        rows.append(evaluate(expression, sample_rules + "\n" + assignments)[0] is Constant(True))
+    return rows
+
+def test_truth_tables_are_built_from_the_rules():
+    tables = TruthTables(sample_rules)
+    assert tables.tables["And"] == [False, False, False, True]
+    assert tables.tables["Xor"] == [False, True, True, False]
+    assert tables.tables["Not"] == [True, False]
+
+def test_evaluate_bits_covers_every_assignment():
+    tables = TruthTables(sample_rules)
+    rows = 2 ** len(variables)
+    columns = {name: sum(1 << row for row in range(rows) if (row >> (len(variables) - 1 - i)) & 1)
+               for i, name in enumerate(variables)}
+    result = tables.evaluate_bits(expression, columns, rows)
+    assert [bool(result >> row & 1) for row in range(rows)] == expected_rows()
+
+def test_evaluate_over_numpy_assignment_matrix():
+    pytest.importorskip("numpy")
+    tables = TruthTables(sample_rules)
+    assert list(tables.evaluate(expression, all_assignments(variables), variables)) == expected_rows()
+
+def test_missing_truth_table_is_reported():
+    tables = TruthTables(sample_rules)
+    with pytest.raises(ValueError):
+        tables.evaluate_bits("Implies(a, b)", {"a": 1, "b": 0}, 1)
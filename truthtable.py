@@ -0,0 +1,162 @@
+"""
+Vectorized truth-table evaluation of boolean rule sets.
+
+For rule sets like sample_rules, where every function applied to true/false arguments
+rewrites to true or false, each function name is compiled into a lookup table with one
+entry per combination of argument values. An expression can then be evaluated over many
+assignments at once, bottom-up, with one table lookup per node for all rows together:
+
+    tables = TruthTables(sample_rules)
+    variables = ['a', 'b', 'c']
+    results = tables.evaluate("Xor(Not(a), Or(b, c))", all_assignments(variables), variables)
+
+evaluate() works on a NumPy boolean matrix with one row per assignment and one column per
+variable. evaluate_bits() does the same without NumPy, with each column packed into the
+bits of a Python int.
+"""
+import itertools
+
+from main import Term, Function, Constant, Variable, compile_rules, normalize, parse_expression, substitute_variables
+
+MAX_TABLE_ARITY = 16
+
+def _require_numpy():
+    try:
+        import numpy
+    except ImportError as error:
+        raise ImportError("Vectorized truth-table evaluation requires NumPy; "
+                          "use TruthTables.evaluate_bits without it") from error
+    return numpy
+
+def all_assignments(variables: list):
+    """Returns the 2**len(variables) x len(variables) boolean matrix of every assignment."""
+    numpy = _require_numpy()
+    count = len(variables)
+    rows = numpy.arange(2 ** count, dtype=numpy.uint64)
+    shifts = numpy.arange(count - 1, -1, -1, dtype=numpy.uint64)
+    return ((rows[:, None] >> shifts) & 1).astype(bool)
+
+class TruthTables:
+    """
+    The truth tables of every function name in a rule set whose boolean instances all
+    normalize to true or false. Each table is found by normalizing the function applied to
+    every combination of constant arguments, so it follows the rule set's own semantics.
+    Bit i of an entry's index (counting from the most significant) is argument i.
+    """
+    def __init__(self, rules):
+        self.rules = compile_rules(rules)
+        self.tables = {}
+        for name in self.rules.rules:
+            arity = self._arity(name)
+            if arity is None or arity > MAX_TABLE_ARITY:
+                continue
+            table = []
+            for values in itertools.product((False, True), repeat=arity):
+                result = normalize(Function(name, [Constant(value) for value in values]), self.rules)
+                if result is not Constant(True) and result is not Constant(False):
+                    break
+                table.append(result.value)
+            else:
+                self.tables[name] = table
+
+    def _arity(self, name: str):
+        if name in self.rules.arities:
+            return self.rules.arities[name]
+        for rule in self.rules.rules_for(name):
+            if isinstance(rule.lhs, Function) and rule.lhs.name == name:
+                return len(rule.lhs.args)
+        return None
+
+    def _prepare(self, expression) -> Term:
+        term = parse_expression(expression) if isinstance(expression, str) else expression
+        return substitute_variables(term, self.rules.assignments)
+
+    def _table_for(self, node: Function) -> list:
+        table = self.tables.get(node.name)
+        if table is None or len(table) != 2 ** len(node.args):
+            raise ValueError(f"No truth table for {node.name}/{len(node.args)}")
+        return table
+
+    def _evaluate_nodes(self, term: Term, leaf, apply):
+        """Evaluates each distinct node of term once, in postorder."""
+        values = {}
+        stack = [term]
+        while stack:
+            node = stack[-1]
+            if node in values:
+                stack.pop()
+                continue
+            if isinstance(node, Function):
+                pending = [arg for arg in node.args if arg not in values]
+                if pending:
+                    stack.extend(pending)
+                    continue
+                values[node] = apply(self._table_for(node), [values[arg] for arg in node.args])
+            else:
+                values[node] = leaf(node)
+            stack.pop()
+        return values[term]
+
+    def evaluate(self, expression, assignments, variables: list):
+        """
+        Evaluates expression for every row of assignments, a boolean matrix with one
+        column per name in variables. Returns a boolean array with one entry per row.
+        """
+        numpy = _require_numpy()
+        assignments = numpy.asarray(assignments, dtype=bool)
+        rows = assignments.shape[0]
+        columns = {name: assignments[:, i] for i, name in enumerate(variables)}
+        table_arrays = {}
+
+        def leaf(node):
+            if isinstance(node, Variable):
+                if node.name not in columns:
+                    raise ValueError(f"No column for variable '{node.name}'")
+                return columns[node.name]
+            if node is Constant(True) or node is Constant(False):
+                return numpy.full(rows, node.value, dtype=bool)
+            raise ValueError(f"Not a boolean constant: {node}")
+
+        def apply(table, args):
+            lookup = table_arrays.get(id(table))
+            if lookup is None:
+                lookup = table_arrays[id(table)] = numpy.array(table, dtype=bool)
+            index = numpy.zeros(rows, dtype=numpy.intp)
+            for arg in args:
+                index <<= 1
+                index |= arg
+            return lookup[index]
+
+        return self._evaluate_nodes(self._prepare(expression), leaf, apply)
+
+    def evaluate_bits(self, expression, columns: dict, rows: int) -> int:
+        """
+        Evaluates expression for rows assignments at once without NumPy. columns maps each
+        variable to an int whose bit r is the variable's value in row r; the result is an
+        int of the same shape.
+        """
+        mask = (1 << rows) - 1
+
+        def leaf(node):
+            if isinstance(node, Variable):
+                if node.name not in columns:
+                    raise ValueError(f"No column for variable '{node.name}'")
+                return columns[node.name] & mask
+            if node is Constant(True) or node is Constant(False):
+                return mask if node.value else 0
+            raise ValueError(f"Not a boolean constant: {node}")
+
+        def apply(table, args):
+            # OR together the rows selecting each table entry that is true.
+            result = 0
+            for index, value in enumerate(table):
+                if not value:
+                    continue
+                selected = mask
+                for position, arg in enumerate(args):
+                    bit = (index >> (len(args) - 1 - position)) & 1
+                    selected &= arg if bit else ~arg & mask
+                result |= selected
+            return result
+
+        return self._evaluate_nodes(self._prepare(expression), leaf, apply)